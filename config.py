@@ -21,6 +21,11 @@ class Config:
     SESSION_REDIS = redis.StrictRedis(host=REDIS_HOST, port=REDIS_POST)  # redis实例化
     PEEMANENT_SESSION_LIFETIME = 86400  # session数据的有效期秒
 
+    # 房屋列表使用每个进程内存中的房屋目录进行过滤排序分页,默认关闭,
+    # 开启后每个进程都要在内存中加载全部房屋,不带日期的列表不再使用redis的排序索引,
+    # 分面搜索也只在开启时使用房屋目录,关闭时在数据库中查询
+    HOUSE_CATALOG_ENABLED = False
+
 
 class DevelopmentConfig(Config):
     """开发模式的配置参数"""
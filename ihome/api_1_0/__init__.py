@@ -1,15 +1,17 @@
 # coding=utf-8
 
 from flask import Blueprint
+from ihome.utils.compress import compress_response
 api = Blueprint('api', __name__)
 from . import register, passport, house, orders
 
 
 @api.after_request
 def after_requset(response):
-    """设置默认的响应报文格式为application/json"""
-    # 如果响应报文response的Content-Type是以text开头，则将其改为默认的json类型
-    # Content-Type = 'text/html'
-    if response.headers.get("Content-Type").startswith("text"):
+    """设置默认的响应报文格式为application/json,并压缩较大的响应体"""
+    # 如果响应报文response的Content-Type是text/html，则将其改为默认的json类型
+    # text/csv等其它类型的响应保持不变
+    if response.headers.get("Content-Type").startswith("text/html"):
         response.headers["Content-Type"] = "application/json"
-    return response
\ No newline at end of file
+    # 客户端支持gzip时压缩较大的响应体
+    return compress_response(response)
\ No newline at end of file
@@ -6,26 +6,44 @@ from ihome import redis_store,constants,db
 # 导入flask内置的对象
 from flask import current_app,jsonify,g,request,session
 # 导入模型类
-from ihome.models import Area,House,Facility,HouseImage,User,Order
+from ihome.models import Area,House,Facility,HouseImage,Order,house_facility
 # 导入自定义的状态码
 from ihome.utils.response_code import RET
 # 导入登陆验证装饰器
-from ihome.utils.commons import login_required
+from ihome.utils.commons import login_required,encode_cursor,decode_cursor
 # 导入七牛云
 from ihome.utils.image_storage import storage
+# 导入房屋已预订日期索引
+from ihome.utils import availability
+# 导入缓存辅助工具
+from ihome.utils import cache
+# 导入房屋排序索引
+from ihome.utils import house_index
+# 导入进程内的房屋目录
+from ihome.utils import catalog
+# 导入房屋关键字搜索
+from ihome.utils import search
+# 导入进程内的一级缓存
+from ihome.utils import local_cache
+# 导入房屋评论列表
+from ihome.utils import comments
+# 导入事务性发件箱
+from ihome.utils import outbox
 
 
 # 导入json模块
 import json
 # 导入日期模块
 import datetime
+# 导入calendar模块,用于计算每个月的天数
+import calendar
 
 @api.route("/areas",methods=['GET'])
 def get_areas_info():
     """
     获取城区信息:
     缓存----磁盘----缓存
-    1/尝试从redis中获取城区信息
+    1/尝试从进程内缓存和redis中获取城区信息,缓存未命中时同一时间只有一个进程执行2-9步
     2/判断查询结果是否有数据,如果有数据
     3/留下访问redis的中城区信息的记录,在日志中
     4/需要查询mysql数据库
@@ -37,42 +55,42 @@ def get_areas_info():
     10/返回结果
     :return:
     """
-    # 尝试从redis中获取程序信息
-    try:
-        areas = redis_store.get('area_info')
-    except Exception as e:
-        current_app.logger.error(e)
-        # 如果查询发生异常,把查询结果置为None
-        areas = None
-    # 判断查询结果存在
-    if areas:
-        # 留下访问redis数据库的记录
-        current_app.logger.info('hit redis areas info')
-        return '{"errno":0,"errmsg":"OK","data":%s}' % areas
-    # 查询mysql数据库
-    try:
+    def load_areas():
+        """查询mysql数据库,把城区信息转成json"""
         areas = Area.query.all()
+        # 判断查询结果,areas是查询到城区信息对象
+        if not areas:
+            return None
+        # 定义容器,遍历查询结果
+        areas_list = []
+        for area in areas:
+            # 需要调用模型类中的to_dict方法,把具体的查询对象转成键值形式的数据
+            areas_list.append(area.to_dict())
+        # 把城区信息转成json
+        return json.dumps(areas_list)
+    def load_areas_with_etag():
+        """读取redis缓存,缓存未命中时同一时间只有一个进程查询mysql数据库并存入缓存"""
+        areas_json,etag = cache.get_or_load_with_etag('area_info',constants.AREA_INFO_REDIS_EXPIRES,load_areas)
+        if not areas_json:
+            return None
+        return areas_json,etag
+    # 优先读取进程内缓存,未命中时读取redis缓存,城区信息和ETag一起缓存
+    try:
+        areas_info = local_cache.get_or_load('area_info',load_areas_with_etag)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR,errmsg='查询城区信息异常')
-    # 判断查询结果,areas是查询到城区信息对象
-    if not areas:
+    # 判断获取结果
+    if not areas_info:
         return jsonify(errno=RET.NODATA,errmsg='无城区信息')
-    # 定义容器,遍历查询结果
-    areas_list = []
-    for area in areas:
-        # 需要调用模型类中的to_dict方法,把具体的查询对象转成键值形式的数据
-        areas_list.append(area.to_dict())
-    # 把城区信息转成json
-    areas_json = json.dumps(areas_list)
-    # 存入到redis中
-    try:
-        redis_store.setex('area_info',constants.AREA_INFO_REDIS_EXPIRES,areas_json)
-    except Exception as e:
-        current_app.logger.error(e)
-    # 返回结果,城区信息已经是json字符串,不需要使用jsonify
+    areas_json,etag = areas_info
+    # 构造响应报文,返回城区信息,客户端的数据没有变化时返回304
     resp = '{"errno":0,"errmsg":"OK","data":%s}' % areas_json
-    return resp
+    return cache.conditional_response(resp,etag)
+
+def load_facility_ids():
+    """查询mysql数据库,获取全部配套设施的编号"""
+    return [facility_id for facility_id, in db.session.query(Facility.id)] or None
 
 @api.route('/houses',methods=['POST'])
 @login_required
@@ -87,9 +105,9 @@ def save_house_info():
     6/对价格参数进行转换,由元转成分
     7/构造模型类对象,准备存储数据
     8/判断配套设施的存在
-    9/需要对配套设施进行过滤查询,后端只会保存数据库中已经定义的配套设施信息
-    facilites = Facility.query.filter(Facility.id.in_(facility)).all()
-    house.facilities = facilities
+    9/需要对配套设施进行过滤,后端只会保存数据库中已经定义的配套设施信息,设施编号缓存在进程内
+    facility_ids = local_cache.get_or_load('facility_ids',load_facility_ids)
+    db.session.execute(house_facility.insert(),...)
     10/保存数据到数据库中
     11/返回结果,house.id,让后面上传房屋图片和房屋进行关联
     :return:
@@ -141,24 +159,41 @@ def save_house_info():
     house.max_days = max_days
     # 尝试获取房屋配套设施参数
     facility = house_data.get('facility')
+    facility_ids = []
     # 判断配套设施存在
     if facility:
-        # 查询数据库,对房屋配套设施进行过滤查询,确保配套设施的编号在数据库中存在
+        # 对房屋配套设施进行过滤,确保配套设施的编号在数据库中存在,设施编号缓存在进程内
         try:
-            facilities = Facility.query.filter(Facility.id.in_(facility)).all()
-            # 保存房屋配套设施信息,配套设施的数据存在第三张表,关系引用在数据库中没有具体的字段
-            house.facilities = facilities
+            all_facility_ids = local_cache.get_or_load('facility_ids',load_facility_ids)
         except Exception as e:
             current_app.logger.error(e)
             return jsonify(errno=RET.DBERR,errmsg='查询配套设施异常')
+        try:
+            facility_ids = set(int(facility_id) for facility_id in facility) & set(all_facility_ids or [])
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR,errmsg='配套设施参数错误')
     # 保存房屋数据到mysql数据库中
     try:
         db.session.add(house)
+        # 先生成房屋编号
+        db.session.flush()
+        # 保存房屋配套设施信息,配套设施的数据存在第三张表
+        if facility_ids:
+            db.session.execute(house_facility.insert(),
+                               [{'house_id':house.id,'facility_id':facility_id} for facility_id in facility_ids])
+        # 在同一个事务中记录事件,由后台worker让该城区的房屋列表缓存失效,并把房屋加入排序索引
+        outbox.add_event('house_changed',house_id=house.id)
         db.session.commit()
     except Exception as e:
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg='保存房屋数据失败')
+    # 把房屋加入本进程的关键字搜索索引,其它进程会在刷新时加载
+    try:
+        search.house_search_index.index_house(house)
+    except Exception as e:
+        current_app.logger.error(e)
     # 返回结果,house.id是用来后面实现上传房屋图片做准备
     return jsonify(errno=RET.OK,errmsg='OK',data={'house_id':house.id})
 
@@ -217,9 +252,15 @@ def save_house_image(house_id):
     # 添加数据到数据库会话对象
     db.session.add(house_image)
     # 判断房屋主图片是否设置,如未设置默认添加当前图片为主图片
-    if not house.index_image_url:
+    index_image_changed = not house.index_image_url
+    if index_image_changed:
         house.index_image_url = image_name
         db.session.add(house)
+    # 在同一个事务中记录事件,由后台worker处理缓存:
+    # 房屋详情中有房屋的图片,删除房屋详情缓存;主图片变化时删除房屋卡片并让房屋列表缓存失效
+    outbox.add_event('house_detail_changed',house_id=house_id)
+    if index_image_changed:
+        outbox.add_event('house_changed',house_id=house_id)
     # 提交数据到mysql数据库中
     try:
         db.session.commit()
@@ -239,7 +280,7 @@ def get_user_houses():
     我的房源
     1/确认用户身份
     2/根据用户id查询数据库
-    3/使用关系定义返回的对象,实现一对多的查询,
+    3/使用House.listing_query()查询用户发布的房屋,一次查询同时加载城区和房东
     4/定义容器
     5/遍历查询结果,调用模型类中的方法
     6/返回数据
@@ -247,12 +288,10 @@ def get_user_houses():
     """
     # 获取用户id
     user_id = g.user_id
-    # 查询mysql数据库,确认用户的存在
+    # 查询mysql数据库
     try:
-        # User.query.filter_by(id=user_id).first()
-        user = User.query.get(user_id)
-        # 使用反向引用,实现一对多的查询,获取该用户发布的所有房屋信息
-        houses = user.houses
+        # 查询该用户发布的所有房屋信息,同时加载城区和房东信息
+        houses = House.listing_query().filter(House.user_id == user_id).all()
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR,errmsg='查询用户房屋数据失败')
@@ -270,7 +309,8 @@ def get_houses_index():
     """
     项目首页幻灯片
     缓存----磁盘----缓存
-    1/尝试查询redis数据库,获取项目首页信息
+    1/尝试查询redis数据库,获取项目首页信息,缓存未命中时同一时间只有一个进程执行4-11步
+    缓存超过软过期时间后仍然直接返回,同时在后台线程中执行4-11步重建缓存
     2/判断查询结果
     3/如果有数据,留下访问的记录,直接返回
     4/查询mysql数据库
@@ -285,44 +325,69 @@ def get_houses_index():
     12/返回结果
     :return:
     """
-    # 尝试从redis缓存中获取首页幻灯片信息
+    def load_houses_index():
+        """查询mysql数据库,把首页房屋数据转成json"""
+        # 默认采取的操作是按照房屋成交次数进行排序,并且使用limit分页五条房屋数据
+        houses = House.listing_query().order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES).all()
+        # 判断查询结果
+        if not houses:
+            return None
+        # 定义容器,遍历存储查询结果
+        houses_list = []
+        for house in houses:
+            # 如果房屋未设置主图片,默认不添加
+            if not house.index_image_url:
+                continue
+            houses_list.append(house.to_basic_dict())
+        # 把房屋数据转成json
+        return json.dumps(houses_list)
+    # 读取redis缓存,缓存未命中时同一时间只有一个进程查询mysql数据库并存入缓存
     try:
-        ret = redis_store.get('home_page_data')
+        houses_json,etag = cache.get_or_load_with_etag('home_page_data',constants.HOME_PAGE_DATA_REDIS_EXPIRES,
+                                                       load_houses_index,soft_expires=constants.HOME_PAGE_DATA_SOFT_EXPIRES)
     except Exception as e:
         current_app.logger.error(e)
-        ret = None
-    # 判断获取结果
-    if ret:
-        # 留下访问redis数据库的记录
-        current_app.logger.info('hit redis houses index info')
-        return '{"errno":0,"errmsg":"OK","data":%s}' % ret
-    # 如未获取,需要查询mysql数据库
+        return jsonify(errno=RET.DBERR,errmsg='查询房屋数据失败')
+    if not houses_json:
+        return jsonify(errno=RET.NODATA,errmsg='无房屋数据')
+    # 构造响应报文,返回幻灯片信息,客户端的数据没有变化时返回304
+    resp = '{"errno":0,"errmsg":"OK","data":%s}' % houses_json
+    return cache.conditional_response(resp,etag)
+
+@api.route('/houses/batch',methods=['GET'])
+def get_houses_batch():
+    """
+    批量获取房屋卡片
+    1/获取参数ids,多个房屋编号使用逗号分隔
+    2/检查参数,房屋编号必须是整数,并且数量不能超过上限
+    3/使用一次MGET读取房屋卡片缓存
+    4/未命中缓存的房屋使用一次IN查询加载,调用模型类中的to_basic_dict()方法
+    5/使用pipeline回填缓存
+    6/按照请求的顺序返回房屋卡片,不存在的房屋会被忽略
+    :return:
+    """
+    # 获取参数
+    ids = request.args.get('ids','')
+    # 检查参数,去掉重复的房屋编号并保留请求的顺序
     try:
-        # 默认采取的操作是按照房屋成交次数进行排序,并且使用limit分页五条房屋数据
-        houses = House.query.order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES)
+        houses_ids = []
+        for house_id in ids.split(','):
+            house_id = int(house_id)
+            if house_id not in houses_ids:
+                houses_ids.append(house_id)
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg='查询房屋数据失败')
-    # 判断查询结果
-    if not houses:
-        return jsonify(errno=RET.NODATA,errmsg='无房屋数据')
-    # 定义容器,遍历存储查询结果
-    houses_list = []
-    for house in houses:
-        # 如果房屋未设置主图片,默认不添加
-        if not house.index_image_url:
-            continue
-        houses_list.append(house.to_basic_dict())
-    # 把房屋数据转成json
-    houses_json = json.dumps(houses_list)
-    # 存入到redis缓存中
+        return jsonify(errno=RET.PARAMERR,errmsg='参数错误')
+    if len(houses_ids) > constants.HOUSE_BATCH_MAX_COUNT:
+        return jsonify(errno=RET.PARAMERR,errmsg='房屋数量超过上限')
+    # 批量获取房屋卡片
     try:
-        redis_store.setex('home_page_data',constants.HOME_PAGE_DATA_REDIS_EXPIRES,houses_json)
+        houses_list = cache.get_house_cards(houses_ids)
     except Exception as e:
         current_app.logger.error(e)
-    # 构造响应报文,返回幻灯片信息
-    resp = '{"errno":0,"errmsg":"OK","data":%s}' % houses_json
-    return resp
+        return jsonify(errno=RET.DBERR,errmsg='查询房屋数据失败')
+    # 返回结果
+    return jsonify(errno=RET.OK,errmsg='OK',data={'houses':houses_list})
 
 @api.route('/houses/<int:house_id>',methods=['GET'])
 def get_house_detail(house_id):
@@ -332,7 +397,7 @@ def get_house_detail(house_id):
     1/确认访问接口的用户身份
     user_id = session.get('user_id',-1)
     2/判断house_id参数的存在
-    3/尝试读取redis缓存,获取房屋详情数据
+    3/尝试读取redis缓存,获取房屋详情数据,缓存未命中时同一时间只有一个进程执行5-9步
     4/判断获取结果
     5/如未获取,读取mysql数据库
     6/判断获取结果
@@ -349,42 +414,312 @@ def get_house_detail(house_id):
     # 判断house_id存在
     if not house_id:
         return jsonify(errno=RET.PARAMERR,errmsg='参数错误')
-    # 尝试读取redis数据库,获取房屋详情数据
+    def load_house_detail():
+        """查询mysql数据库,把房屋详情数据转成json"""
+        # 同时加载房东/图片/设施,避免to_full_dict()中逐个查询
+        house = House.detail_query().filter(House.id == house_id).first()
+        # 判断查询结果
+        if not house:
+            return None
+        # 调用模型类中的to_full_dict()方法,该方法中查询了评论和评论的用户
+        return json.dumps(house.to_full_dict())
+    # 读取redis缓存,缓存未命中时同一时间只有一个进程查询mysql数据库并存入缓存
     try:
-        ret = redis_store.get('house_info_%s' % house_id)
+        house_json,etag = cache.get_or_load_with_etag('house_info_%s' % house_id,
+                                                      constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND,load_house_detail)
     except Exception as e:
         current_app.logger.error(e)
-        ret = None
-    # 判断获取结果
-    if ret:
-        # 留下访问redis的记录
-        current_app.logger.info('hit redis house detail info')
-        return '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,ret)
-    # 查询磁盘数据库
+        return jsonify(errno=RET.DBERR,errmsg='查询房屋详情数据失败')
+    if not house_json:
+        return jsonify(errno=RET.NODATA,errmsg='无房屋数据')
+    # 构造响应报文,返回结果,客户端的数据没有变化时返回304
+    resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json)
+    # 响应中带有用户编号,ETag需要区分用户;登录用户的响应各不相同,压缩后的响应体不存入redis
+    return cache.conditional_response(resp,'%s-%s' % (etag,user_id),cache_gzip=user_id == -1)
+
+@api.route('/houses/<int:house_id>/comments',methods=['GET'])
+def get_house_comments(house_id):
+    """
+    获取房屋评论列表
+    1/获取参数cursor,首页不携带cursor
+    2/解析游标参数
+    3/读取redis中的评论列表缓存,缓存不存在时查询mysql数据库重建
+    4/从缓存中取出游标之后的一页评论,超出缓存范围时查询mysql数据库
+    5/返回结果,next_cursor用于获取下一页,为空表示没有更多评论
+    :param house_id:
+    :return:
+    """
+    # 获取参数
+    cursor = request.args.get('cursor')
+    # 解析游标参数
     try:
-        house = House.query.get(house_id)
+        cursor = comments.decode_comment_cursor(cursor) if cursor else None
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg='查询房屋数据失败')
-    # 判断查询结果
-    if not house:
+        return jsonify(errno=RET.PARAMERR,errmsg='游标参数错误')
+    # 获取一页评论
+    try:
+        comments_list,next_cursor = comments.get_comments_page(house_id,cursor)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR,errmsg='查询评论信息失败')
+    # 返回结果
+    return jsonify(errno=RET.OK,errmsg='OK',data={'comments':comments_list,'next_cursor':next_cursor or ''})
+
+def add_months(date,months):
+    """计算date之后months个月的前一天,例如2017-01-15之后1个月为2017-02-14"""
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    day = min(date.day,calendar.monthrange(year,month)[1])
+    return datetime.date(year,month,day) - datetime.timedelta(days=1)
+
+def build_house_calendar_query(house_id,today):
+    """构造查询房屋占用状态并且没有结束的订单日期的查询对象,按入住日期排序"""
+    return db.session.query(Order.begin_date,Order.end_date)\
+        .filter(Order.house_id == house_id,Order.status.in_(constants.ORDER_BLOCKING_STATUS),
+                Order.end_date >= today).order_by(Order.begin_date)
+
+@api.route('/houses/<int:house_id>/calendar',methods=['GET'])
+def get_house_calendar(house_id):
+    """
+    获取房屋的预订日历
+    1/获取参数from(开始日期,默认今天),months(月数,默认1)
+    2/检查参数,开始日期不能早于今天,月数不能超过上限
+    3/尝试读取redis缓存,获取房屋今天之后的全部已预订日期段,缓存未命中时同一时间只有一个进程执行4-6步
+    4/确认房屋存在,不存在时返回无数据,不写入缓存;使用一次查询获取房屋占用状态并且没有结束的订单的日期,使用订单表的复合索引
+    5/合并重叠或相邻的日期段,转成json
+    6/存入redis缓存中,下单/拒单/取消订单修改已预订日期索引时删除缓存
+    7/截取[from, from+months)范围内的日期段
+    8/返回结果,booked为[[开始日期, 结束日期]],包含两端
+    :param house_id:
+    :return:
+    """
+    # 获取参数
+    from_str = request.args.get('from','')
+    months = request.args.get('months','1')
+    # 检查参数
+    today = datetime.date.today()
+    try:
+        from_date = datetime.datetime.strptime(from_str,'%Y-%m-%d').date() if from_str else today
+        months = int(months)
+        assert 0 < months <= constants.HOUSE_CALENDAR_MAX_MONTHS
+        from_date = max(from_date,today)
+        # 结束日期超出日期范围时同样是参数错误
+        to_date = add_months(from_date,months)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR,errmsg='参数错误')
+    def load_house_calendar():
+        """查询mysql数据库,把房屋没有结束的已预订日期段转成json,房屋不存在时返回None,不写入缓存"""
+        if db.session.query(House.id).filter(House.id == house_id).first() is None:
+            return None
+        orders = build_house_calendar_query(house_id,today).all()
+        # 合并重叠或相邻的日期段
+        ranges = []
+        for begin_date,end_date in orders:
+            begin_date,end_date = begin_date.date(),end_date.date()
+            if ranges and begin_date <= ranges[-1][1] + datetime.timedelta(days=1):
+                ranges[-1][1] = max(ranges[-1][1],end_date)
+            else:
+                ranges.append([begin_date,end_date])
+        return json.dumps([[begin_date.strftime('%Y-%m-%d'),end_date.strftime('%Y-%m-%d')]
+                           for begin_date,end_date in ranges])
+    # 读取redis缓存,缓存未命中时同一时间只有一个进程查询mysql数据库并存入缓存
+    try:
+        calendar_json,etag = cache.get_or_load_with_etag(availability.calendar_key(house_id),
+                                                         constants.HOUSE_CALENDAR_REDIS_EXPIRES,load_house_calendar)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR,errmsg='查询预订日历失败')
+    if calendar_json is None:
         return jsonify(errno=RET.NODATA,errmsg='无房屋数据')
-    # 调用模型类中的to_ful_dict()方法,因为该方法中查询了数据库,所以需要异常处理
+    # 截取请求范围内的日期段,日期字符串可以直接比较大小
+    from_str,to_str = from_date.strftime('%Y-%m-%d'),to_date.strftime('%Y-%m-%d')
+    booked = []
+    for begin_str,end_str in json.loads(calendar_json):
+        if end_str >= from_str and begin_str <= to_str:
+            booked.append([max(begin_str,from_str),min(end_str,to_str)])
+    # 返回结果,客户端的数据没有变化时返回304
+    resp = json.dumps({'errno':RET.OK,'errmsg':'OK','data':{'from':from_str,'to':to_str,'booked':booked}})
+    return cache.conditional_response(resp,'%s-%s-%s' % (etag,from_str,to_str))
+
+def build_houses_query(area_id,start_date,end_date,sort_key,query=None,use_booked_index=True):
+    """
+    构造房屋列表的查询对象
+    日期冲突的过滤使用NOT EXISTS子查询,由数据库按房屋逐一探测订单表的复合索引,
+    只有处于占用状态的订单才会和用户选择的日期冲突;
+    已预订日期索引就绪且冲突房屋不多时,直接使用索引中的房屋编号过滤
+    :param area_id: 城区编号,为空表示不限
+    :param start_date: 入住日期,可以为None
+    :param end_date: 离开日期,可以为None
+    :param sort_key: 排序条件
+    :param query: 基础查询对象,默认为House.listing_query()
+    :param use_booked_index: 是否使用已预订日期索引,为False时总是使用NOT EXISTS子查询
+    :return: 排序后的查询对象
+    """
+    # 定义容器,存储过滤条件
+    params_filter = []
+    # 如果城区参数存在
+    if area_id:
+        params_filter.append(House.area_id == area_id)
+    # 如果用户选择了日期,目标是查询日期不冲突的房屋
+    if start_date or end_date:
+        conflict_houses_id = None
+        if start_date and end_date and use_booked_index:
+            try:
+                conflict_houses_id = availability.get_booked_house_ids(start_date,end_date)
+            except Exception as e:
+                current_app.logger.error(e)
+        if conflict_houses_id is not None and len(conflict_houses_id) <= constants.AVAILABILITY_NOTIN_MAX_IDS:
+            if conflict_houses_id:
+                params_filter.append(House.id.notin_(list(conflict_houses_id)))
+        else:
+            # 与房屋关联的占用状态的订单,日期与用户选择的日期有重叠
+            conflict_filter = [Order.house_id == House.id,Order.status.in_(constants.ORDER_BLOCKING_STATUS)]
+            if end_date:
+                conflict_filter.append(Order.begin_date <= end_date)
+            if start_date:
+                conflict_filter.append(Order.end_date >= start_date)
+            params_filter.append(~db.exists().where(db.and_(*conflict_filter)))
+    if query is None:
+        query = House.listing_query()
+    houses = query.filter(*params_filter)
+    # 按照排序条件排序,排序值相同时再按照房屋编号排序,保证分页结果稳定
+    sort_column,descending = get_house_sort_column(sort_key)
+    if descending:
+        return houses.order_by(sort_column.desc(),House.id.desc())
+    return houses.order_by(sort_column.asc(),House.id.asc())
+
+def get_house_sort_column(sort_key):
+    """
+    获取排序条件对应的字段和排序方向
+    booking按照房屋成交次数,price-inc/price-des按照价格升序/降序,默认按照房屋发布时间
+    :return: (字段, 是否降序)
+    """
+    if 'booking' == sort_key:
+        return House.order_count,True
+    elif 'price-inc' == sort_key:
+        return House.price,False
+    elif 'price-des' == sort_key:
+        return House.price,True
+    return House.create_time,True
+
+def encode_house_cursor(sort_key,house):
+    """把页面最后一套房屋的排序值和编号编码为游标字符串"""
+    sort_column,descending = get_house_sort_column(sort_key)
+    value = getattr(house,sort_column.key)
+    if isinstance(value,datetime.datetime):
+        value = value.strftime('%Y-%m-%d %H:%M:%S')
+    return encode_cursor([sort_key,value,house.id])
+
+def decode_house_cursor(sort_key,cursor):
+    """
+    解析游标字符串,返回游标之后的房屋的过滤条件
+    游标与排序条件不一致时抛出异常
+    """
+    cursor_sort_key,value,house_id = decode_cursor(cursor)
+    if cursor_sort_key != sort_key:
+        raise ValueError('cursor does not match sort key')
+    sort_column,descending = get_house_sort_column(sort_key)
+    if sort_column.key == 'create_time':
+        value = datetime.datetime.strptime(value,'%Y-%m-%d %H:%M:%S')
+    else:
+        value = int(value)
+    house_id = int(house_id)
+    if descending:
+        return db.or_(sort_column < value,db.and_(sort_column == value,House.id < house_id))
+    return db.or_(sort_column > value,db.and_(sort_column == value,House.id > house_id))
+
+def get_houses_total_page(houses,area_id,start_date_str,end_date_str):
+    """
+    游标分页模式下的总页数,与排序条件无关,单独缓存,缓存失效时才执行COUNT查询
+    """
     try:
-        house_data = house.to_full_dict()
+        version = cache.houses_list_version(area_id,start_date_str or end_date_str)
+        redis_key = 'houses_total_%s_%s_%s_%s' % (area_id,start_date_str,end_date_str,version)
+        total = redis_store.get(redis_key)
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg='查询房屋详情数据失败')
-    # 转成json
-    house_json = json.dumps(house_data)
-    # 把房屋详情数据存入redis缓存中
+        redis_key,total = None,None
+    if total is not None:
+        total = int(total)
+    else:
+        total = houses.order_by(None).count()
+        try:
+            if redis_key:
+                redis_store.setex(redis_key,constants.HOUSE_LIST_REDIS_EXPIRES,total)
+        except Exception as e:
+            current_app.logger.error(e)
+    return (total + constants.HOUSE_LIST_PAGE_CAPACITY - 1) // constants.HOUSE_LIST_PAGE_CAPACITY
+
+def search_houses_page(houses,keyword,sort_key,page):
+    """
+    关键字搜索的一页房屋编号
+    倒排索引返回按相关度排列的房屋编号,在数据库中过滤出满足城区和日期条件的房屋,
+    按相关度排序时保持倒排索引的顺序,否则按照查询对象的排序条件排序
+    :param houses: build_houses_query构造的只查询房屋编号的查询对象
+    :return: (房屋编号列表, 房屋总数)
+    """
+    matched_ids = search.search_houses(keyword)
+    if not matched_ids:
+        return [],0
+    houses_ids = [house_id for house_id, in houses.filter(House.id.in_(matched_ids))]
+    if 'relevance' == sort_key:
+        allowed_ids = set(houses_ids)
+        houses_ids = [house_id for house_id in matched_ids if house_id in allowed_ids]
+    start = (page - 1) * constants.HOUSE_LIST_PAGE_CAPACITY
+    return houses_ids[start:start + constants.HOUSE_LIST_PAGE_CAPACITY],len(houses_ids)
+
+def facet_search_houses_page(area_id,start_date,end_date,sort_key,page,facet_filters):
+    """
+    没有启用房屋目录时在数据库中进行分面搜索,设施条件使用房屋设施表的子查询,
+    每种设施的房屋数使用一次分组查询
+    :param facet_filters: facility_ids/min_price/max_price/min_capacity/min_room_count组成的字典
+    :return: (房屋编号列表, 房屋总数, 设施计数)
+    """
+    params_filter = []
+    for facility_id in facet_filters['facility_ids'] or []:
+        params_filter.append(House.id.in_(db.session.query(house_facility.c.house_id)
+                                          .filter(house_facility.c.facility_id == facility_id)))
+    if facet_filters['min_price'] is not None:
+        params_filter.append(House.price >= facet_filters['min_price'])
+    if facet_filters['max_price'] is not None:
+        params_filter.append(House.price <= facet_filters['max_price'])
+    if facet_filters['min_capacity']:
+        params_filter.append(House.capacity >= facet_filters['min_capacity'])
+    if facet_filters['min_room_count']:
+        params_filter.append(House.room_count >= facet_filters['min_room_count'])
+    houses = build_houses_query(area_id,start_date,end_date,sort_key,db.session.query(House.id).filter(*params_filter))
+    total = houses.order_by(None).count()
+    start = (page - 1) * constants.HOUSE_LIST_PAGE_CAPACITY
+    houses_ids = [house_id for house_id, in houses.offset(start).limit(constants.HOUSE_LIST_PAGE_CAPACITY)]
+    matched_ids = houses.order_by(None).subquery()
+    facets = dict(db.session.query(house_facility.c.facility_id,db.func.count(house_facility.c.house_id))
+                  .filter(house_facility.c.house_id.in_(db.session.query(matched_ids.c.id)))
+                  .group_by(house_facility.c.facility_id).all())
+    return houses_ids,total,facets
+
+def get_houses_page_ids(area_id,start_date,end_date,sort_key,page):
+    """
+    不查询mysql数据库,获取一页房屋编号
+    启用房屋目录时使用进程内的房屋目录,否则不按日期过滤时使用redis的排序索引
+    :return: (房屋编号列表, 房屋总数),都无法使用时返回None
+    """
+    if current_app.config.get('HOUSE_CATALOG_ENABLED'):
+        try:
+            ids_page = catalog.search_page(area_id,start_date,end_date,sort_key,page)
+            if ids_page is not None:
+                return ids_page
+        except Exception as e:
+            current_app.logger.error(e)
+    if start_date or end_date:
+        return None
     try:
-        redis_store.setex('house_info_%s' % house_id,constants.HOME_PAGE_DATA_REDIS_EXPIRES,house_json)
+        return house_index.get_page(area_id,sort_key,page,constants.HOUSE_LIST_PAGE_CAPACITY)
     except Exception as e:
         current_app.logger.error(e)
-    # 构造响应报文,返回结果
-    resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json)
-    return resp
+        return None
 
 @api.route("/houses",methods=['GET'])
 def get_houses_list():
@@ -392,21 +727,23 @@ def get_houses_list():
     获取房屋列表信息
     缓存----磁盘----缓存
     获取参数---检查参数---查询数据---返回结果
-    1/获取参数:aid,sd,ed,sk,p
+    1/获取参数:aid,sd,ed,sk,p,cursor(携带cursor参数时使用游标分页,首页的cursor为空)
+    分面搜索参数:fac,pmin,pmax,cap,rc,携带任意一个时使用分面搜索,响应中返回每种设施的房屋数facets
+    关键字搜索参数:q,在房屋标题和地址中搜索,没有指定sk时按照相关度排序
     2/需要对排序条件和页面两个参数,进行默认处理
     3/需要对日期参数进行判断,并且进行格式化
     4/需要对页数进行格式化
     5/尝试从redis缓存中获取房屋列表信息
-    6/让一个键对应多条数据的存储,需要hash数据类型,构造hash对象的键
-    redis_key = 'houses_%s_%s_%s_%s' %(aid,sd,ed,sk)
-    ret = redis_store.hget(redis_key,page)
-    7/如果有数据,留下访问的记录,直接返回
+    6/让一个键对应多条数据的存储,需要hash数据类型,构造hash对象的键,键中带有城区和订单的版本号
+    redis_key = 'houses_%s_%s_%s_%s_%s' %(aid,sd,ed,sk,version)
+    ret,etag = redis_store.hmget(redis_key,[page,'etag_%s' % page])
+    7/如果有数据,留下访问的记录,直接返回,客户端的If-None-Match与ETag一致时返回304
     8/查询mysql数据库
-    9/首先定义容器存储查询数据库的过滤条件
-    10/判断区域参数的存在,如果有把区域信息添加到列表中
-    11/需要判断日期参数的存在,把用户选择的日期和订单表中的日期进行比较,找到日期不冲突的房屋返回给客户端
-    12/根据容器中存储的过滤条件,执行查询排序,price/crate_time
-    houses = House.query.filter(过滤条件).order_by(House.order_count.desc())
+    9/调用build_houses_query构造查询对象
+    10/判断区域参数的存在,如果有把区域信息添加到过滤条件中
+    11/需要判断日期参数的存在,使用NOT EXISTS子查询过滤掉日期冲突的房屋
+    12/根据过滤条件,执行查询排序,price/crate_time
+    houses = build_houses_query(aid,sd,ed,sk)
     13/对排序结果进行分页
     houses_page = houses.paginate(page,每页条目数,False)
     total_page = houses_page.pages
@@ -422,9 +759,12 @@ def get_houses_list():
     pip = redis_store.pipline()
     pip.multi()
     pip.hset(redis_key,page,resp_json)
+    pip.hset(redis_key,'etag_%s' % page,etag)
     pip.expire(redis_key,7200)
     pip.execute()
     19/返回结果,return resp_json
+    游标分页模式:按照排序值和房屋编号定位到游标之后的数据,不再执行OFFSET扫描,
+    响应中的next_cursor用于获取下一页,为空表示没有更多数据
     :return:
     """
     # 获取参数,区域信息/开始日期/结束日期/排序条件/页数
@@ -433,6 +773,11 @@ def get_houses_list():
     end_date_str = request.args.get('ed','')
     sort_key = request.args.get('sk','new')
     page = request.args.get('p','1')
+    cursor = request.args.get('cursor')
+    keyword = request.args.get('q','').strip()
+    # 关键字搜索没有指定排序条件时,按照相关度排序
+    if keyword and not request.args.get('sk'):
+        sort_key = 'relevance'
     # 检查日期参数
     try:
         # 定义变量存储格式化后的日期
@@ -456,90 +801,133 @@ def get_houses_list():
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DATAERR,errmsg='页数格式错误')
+    # 页数小于1时按第一页处理,与数据库分页的行为一致
+    page = max(page,1)
+    # 检查游标参数
+    seek_filter = None
+    if cursor:
+        try:
+            seek_filter = decode_house_cursor(sort_key,cursor)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR,errmsg='游标参数错误')
+    # 检查分面搜索参数:fac设施编号(逗号分隔)/pmin,pmax价格区间(元)/cap最少人数/rc最少房间数
+    facet_params = [request.args.get(name,'') for name in ('fac','pmin','pmax','cap','rc')]
+    facet_filters = None
+    if any(facet_params):
+        if cursor is not None:
+            return jsonify(errno=RET.PARAMERR,errmsg='分面搜索不支持游标分页')
+        try:
+            facility,min_price,max_price,min_capacity,min_room_count = facet_params
+            facet_filters = {
+                'facility_ids':[int(facility_id) for facility_id in facility.split(',')] if facility else None,
+                'min_price':int(float(min_price)*100) if min_price else None,
+                'max_price':int(float(max_price)*100) if max_price else None,
+                'min_capacity':int(min_capacity) if min_capacity else None,
+                'min_room_count':int(min_room_count) if min_room_count else None,
+            }
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR,errmsg='分面搜索参数错误')
+    if keyword and (cursor is not None or facet_filters is not None):
+        return jsonify(errno=RET.PARAMERR,errmsg='关键字搜索不支持游标分页和分面搜索')
+    # 缓存中页面数据的字段,游标分页模式使用游标作为字段
+    cache_field = page if cursor is None else 'cursor_%s' % cursor
     # 尝试从redis缓存中获取房屋列表信息
     # 一个键对应多条数据,使用hash数据类型
-    try:
-        redis_key = 'houses_%s_%s_%s_%s' % (area_id,start_date_str,end_date_str,sort_key)
-        ret = redis_store.hget(redis_key,page)
-    except Exception as e:
-        current_app.logger.error(e)
-        ret = None
+    # 键中带有城区和订单的版本号,房屋或订单变化后旧的缓存不会再被读取
+    redis_key,ret,etag = None,None,None
+    # 分面搜索和关键字搜索的结果不存入缓存,房屋目录和搜索索引在进程内各自刷新
+    if facet_filters is None and not keyword:
+        try:
+            version = cache.houses_list_version(area_id,start_date_str or end_date_str)
+            redis_key = 'houses_%s_%s_%s_%s_%s' % (area_id,start_date_str,end_date_str,sort_key,version)
+            # 页面数据的ETag保存在同一个hash中
+            ret,etag = redis_store.hmget(redis_key,[cache_field,'etag_%s' % cache_field])
+        except Exception as e:
+            current_app.logger.error(e)
+            redis_key,ret,etag = None,None,None
     # 判断ret是否存在
     if ret:
         # 留下访问redis数据的记录
         current_app.logger.info('hit redis houses list info')
-        return ret
+        # 客户端的数据没有变化时返回304
+        return cache.conditional_response(ret,etag or cache.make_etag(ret))
     # 查询mysql数据库
     try:
-        # 定义容器,存储过滤条件
-        params_filter = []
-        # 如果城区参数存在
-        if area_id:
-            # 添加的是城区数据的对象
-            params_filter.append(House.area_id == area_id)
-        # 如果开始日期和结束日期参数存在,目标是查询日期不冲突的房屋
-        if start_date and end_date:
-            # 查询日期冲突的订单
-            conflict_orders = Order.query.filter(Order.begin_date<=end_date,Order.end_date>=start_date).all()
-            # 遍历日期有冲突的订单,获取有冲突的房屋
-            conflict_houses_id = [order.house_id for order in conflict_orders]
-            # 判断有冲突的房屋是否存在,对有冲突的房屋进行取反,获取日期不冲突的房屋
-            if conflict_houses_id:
-                params_filter.append(House.id.notin_(conflict_houses_id))
-        # 如果用户只选择了一个开始日期
-        elif start_date:
-            conflict_orders = Order.query.filter(Order.end_date>=start_date).all()
-            conflict_houses_id = [order.house_id for order in conflict_orders]
-            if conflict_houses_id:
-                params_filter.append(House.id.notin_(conflict_houses_id))
-        # 如果用户值选择了一个结束日期
-        elif end_date:
-            conflict_orders = Order.query.filter(Order.begin_date<=end_date).all()
-            conflict_houses_id = [order.house_id for order in conflict_orders]
-            if conflict_houses_id:
-                params_filter.append(House.id.notin_(conflict_houses_id))
-        # 判断排序条件,按照房屋成交次数排序
-        if 'booking' == sort_key:
-            # *params_filter是往查询方法进行拆包
-            houses = House.query.filter(*params_filter).order_by(House.order_count.desc())
-        # 按照价格进行升序和降序排序
-        elif 'price-inc' == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.price.asc())
-        elif 'price-des' == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.price.desc())
-        # 默认按照房屋房屋时间
+        # 构造房屋列表的查询对象,日期冲突的过滤在数据库中完成
+        houses = build_houses_query(area_id,start_date,end_date,sort_key)
+        next_cursor = None
+        # 优先从进程内的房屋目录或redis的排序索引中分页获取房屋编号,再批量获取房屋卡片
+        ids_page = None
+        facets = None
+        if facet_filters is not None:
+            if current_app.config.get('HOUSE_CATALOG_ENABLED'):
+                # 分面搜索,使用进程内房屋目录中的设施位图和分桶位图
+                houses_ids,total,facets = catalog.facet_search_page(area_id,start_date,end_date,sort_key,page,
+                                                                    facet_filters)
+            else:
+                # 没有启用房屋目录时不在进程内加载全部房屋,在数据库中过滤和计数
+                houses_ids,total,facets = facet_search_houses_page(area_id,start_date,end_date,sort_key,page,
+                                                                   facet_filters)
+            ids_page = houses_ids,total
+        elif keyword:
+            # 关键字搜索,从倒排索引中获取相关的房屋,再与城区和日期条件组合
+            ids_query = build_houses_query(area_id,start_date,end_date,sort_key,db.session.query(House.id))
+            ids_page = search_houses_page(ids_query,keyword,sort_key,page)
+        elif cursor is None:
+            ids_page = get_houses_page_ids(area_id,start_date,end_date,sort_key,page)
+        if ids_page is not None:
+            houses_ids,total = ids_page
+            houses_list = None
+            houses_dict_list = cache.get_house_cards(houses_ids)
+            total_page = (total + constants.HOUSE_LIST_PAGE_CAPACITY - 1) // constants.HOUSE_LIST_PAGE_CAPACITY
+        elif cursor is None:
+            # 对排序后的房屋进行分页,page代表页数,每页条目书,False分页异常不报错
+            houses_page = houses.paginate(page,constants.HOUSE_LIST_PAGE_CAPACITY,False)
+            # 获取分页后的房屋数据
+            houses_list = houses_page.items
+            # 获取分页后的总页数
+            total_page = houses_page.pages
         else:
-            houses = House.query.filter(*params_filter).order_by(House.create_time.desc())
-        # 对排序后的房屋进行分页,page代表页数,每页条目书,False分页异常不报错
-        houses_page = houses.paginate(page,constants.HOUSE_LIST_PAGE_CAPACITY,False)
-        print '111111',houses_page
-        # 获取分页后的房屋数据
-        houses_list = houses_page.items
-        print '22222',houses_list
-        # 获取分页后的总页数
-        total_page = houses_page.pages
-        print '33333',total_page
+            # 游标分页,多查询一条数据用来判断是否还有下一页
+            total_page = get_houses_total_page(houses,area_id,start_date_str,end_date_str)
+            if seek_filter is not None:
+                houses = houses.filter(seek_filter)
+            houses_list = houses.limit(constants.HOUSE_LIST_PAGE_CAPACITY + 1).all()
+            if len(houses_list) > constants.HOUSE_LIST_PAGE_CAPACITY:
+                houses_list = houses_list[:constants.HOUSE_LIST_PAGE_CAPACITY]
+                next_cursor = encode_house_cursor(sort_key,houses_list[-1])
         # 定义容器,遍历分页后的房屋数据,需要调用模型类中的方法
-        houses_dict_list = []
-        for house in houses_list:
-            houses_dict_list.append(house.to_basic_dict())
+        if houses_list is not None:
+            houses_dict_list = []
+            for house in houses_list:
+                houses_dict_list.append(house.to_basic_dict())
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR,errmsg='查询房屋列表信息失败')
     # 构造响应数据
-    resp = {"errno":0,"errmsg":"OK","data":{"houses":houses_dict_list,"total_page":total_page,"current_page":page}}
+    if facets is not None:
+        resp = {"errno":0,"errmsg":"OK","data":{"houses":houses_dict_list,"total_page":total_page,"current_page":page,"facets":facets}}
+    elif cursor is None:
+        resp = {"errno":0,"errmsg":"OK","data":{"houses":houses_dict_list,"total_page":total_page,"current_page":page}}
+    else:
+        resp = {"errno":0,"errmsg":"OK","data":{"houses":houses_dict_list,"total_page":total_page,"next_cursor":next_cursor or ""}}
     # 序列化数据,准备存入缓存中
     resp_json = json.dumps(resp)
+    etag = cache.make_etag(resp_json)
     # 判断用户请求的页数必须小于等于分页后的总页数
-    if page <= total_page:
-        redis_key = 'houses_%s_%s_%s_%s' % (area_id,start_date_str,end_date_str,sort_key)
+    # 进程内房屋目录和排序索引得到的页面不存入缓存,目录每隔几秒才刷新一次,存入后会在缓存中保留到过期
+    if redis_key and ids_page is None and \
+            ((cursor is None and page <= total_page) or (cursor is not None and houses_dict_list)):
         # 多条数据的存储,为了确保数据的完整性和一致性,需要使用事务
         pip = redis_store.pipeline()
         try:
             # 开启事务
             pip.multi()
             # 保存数据
-            pip.hset(redis_key,page,resp_json)
+            pip.hset(redis_key,cache_field,resp_json)
+            pip.hset(redis_key,'etag_%s' % cache_field,etag)
             # 设置过期时间
             pip.expire(redis_key,constants.HOUSE_LIST_REDIS_EXPIRES)
             # 执行事务
@@ -547,7 +935,7 @@ def get_houses_list():
         except Exception as e:
             current_app.logger.error(e)
     # 返回结果
-    return resp_json
+    return cache.conditional_response(resp_json,etag)
 
 
 
@@ -1,12 +1,15 @@
 # coding=utf-8
 
 import datetime
+import json
 
-from flask import request, g, jsonify, current_app
-from ihome import db, redis_store
-from ihome.utils.commons import login_required
+from flask import request, g, jsonify, current_app, Response, stream_with_context
+from sqlalchemy.orm import contains_eager
+from ihome import db, constants
+from ihome.utils.commons import login_required, encode_cursor, decode_cursor
 from ihome.utils.response_code import RET
 from ihome.models import House, Order
+from ihome.utils import outbox
 from . import api
 
 
@@ -48,18 +51,30 @@ def save_order():
     # 预订的房屋是否是房东自己的
     if user_id == house.user_id:
         return jsonify(errno=RET.ROLEERR, errmsg="不能预订自己的房屋")
-    # 确保用户预订的时间内，房屋没有被别人下单
+    # 订单总额
+    house_price = house.price
+    amount = days * house_price
+    # 结束查询房屋信息的事务，之后的冲突检查在获得房屋的行锁之后读取最新的数据
+    db.session.rollback()
+    # 同一套房屋的冲突检查和保存订单需要串行执行，不同房屋之间互不影响
+    # 使用数据库的行锁，同一套房屋的并发请求排队等待，日期不冲突的请求依然可以下单成功
     try:
-        # 查询时间冲突的订单数
-        count = Order.query.filter(Order.house_id == house_id,Order.begin_date <= end_date,
-                                   Order.end_date >= start_date).count()
+        # 锁定房屋数据行
+        db.session.query(House.id).filter(House.id == house_id).with_for_update().first()
+        # 确保用户预订的时间内，房屋没有被别人下单
+        # 查询是否存在时间冲突并且仍然占用房屋的订单
+        conflict = db.session.query(db.exists().where(db.and_(
+            Order.house_id == house_id,
+            Order.status.in_(constants.ORDER_BLOCKING_STATUS),
+            Order.begin_date <= end_date,
+            Order.end_date >= start_date))).scalar()
     except Exception as e:
         current_app.logger.error(e)
+        db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="检查出错，请稍候重试")
-    if count > 0:
+    if conflict:
+        db.session.rollback()
         return jsonify(errno=RET.DATAERR, errmsg="房屋已被预订")
-    # 订单总额
-    amount = days * house.price
     # 保存订单数据
     order = Order()
     order.house_id = house_id
@@ -67,10 +82,12 @@ def save_order():
     order.begin_date = start_date
     order.end_date = end_date
     order.days = days
-    order.house_price = house.price
+    order.house_price = house_price
     order.amount = amount
     try:
         db.session.add(order)
+        # 在同一个事务中记录事件，由后台worker把预订的日期记录到已预订日期索引中，并让按日期过滤的房屋列表缓存失效
+        outbox.add_event("order_booked", house_id=house_id, begin_date=start_date_str, end_date=end_date_str)
         db.session.commit()
     except Exception as e:
         current_app.logger.error(e)
@@ -78,25 +95,62 @@ def save_order():
         return jsonify(errno=RET.DBERR, errmsg="保存订单失败")
     return jsonify(errno=RET.OK, errmsg="OK", data={"order_id": order.id})
 
+def encode_order_cursor(order):
+    """把页面最后一个订单的创建时间和订单编号编码为游标字符串"""
+    return encode_cursor([order.create_time.strftime("%Y-%m-%d %H:%M:%S"), order.id])
+
+def decode_order_cursor(cursor):
+    """解析游标字符串，返回游标之后的订单的过滤条件"""
+    create_time, order_id = decode_cursor(cursor)
+    create_time = datetime.datetime.strptime(create_time, "%Y-%m-%d %H:%M:%S")
+    order_id = int(order_id)
+    return db.or_(Order.create_time < create_time, db.and_(Order.create_time == create_time, Order.id < order_id))
+
+def build_user_orders_query(user_id, role):
+    """
+    构造用户订单列表的查询对象，按下单时间从新到旧排序
+    订单和房屋使用一条连接查询，to_dict不再逐个查询房屋
+    """
+    query = Order.query.join(Order.house).options(contains_eager(Order.house))
+    if "landlord" == role:
+        # 以房东的身份查询订单，查询预订了自己房子的订单
+        query = query.filter(House.user_id == user_id)
+    else:
+        # 以房客的身份查询订单， 查询自己预订的订单
+        query = query.filter(Order.user_id == user_id)
+    return query.order_by(Order.create_time.desc(), Order.id.desc())
+
 @api.route("/user/orders", methods=["GET"])
 @login_required
 def get_user_orders():
-    """查询用户的订单信息"""
+    """
+    查询用户的订单信息
+    使用游标分页，每页USER_ORDER_PAGE_CAPACITY个订单，没有cursor参数或者cursor为空时返回第一页，
+    响应中的next_cursor用于获取下一页，为空表示没有更多订单
+    """
     user_id = g.user_id
     # 用户的身份，用户想要查询作为房客预订别人房子的订单，还是想要作为房东查询别人预订自己房子的订单
     role = request.args.get("role", "")
+    cursor = request.args.get("cursor")
+    # 检查游标参数
+    seek_filter = None
+    if cursor:
+        try:
+            seek_filter = decode_order_cursor(cursor)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR, errmsg="游标参数错误")
     # 查询订单数据
     try:
-        if "landlord" == role:
-            # 以房东的身份查询订单
-            # 先查询属于自己的房子有哪些
-            houses = House.query.filter(House.user_id == user_id).all()
-            houses_ids = [house.id for house in houses]
-            # 再查询预订了自己房子的订单
-            orders = Order.query.filter(Order.house_id.in_(houses_ids)).order_by(Order.create_time.desc()).all()
-        else:
-            # 以房客的身份查询订单， 查询自己预订的订单
-            orders = Order.query.filter(Order.user_id == user_id).order_by(Order.create_time.desc()).all()
+        query = build_user_orders_query(user_id, role)
+        # 游标分页，多查询一条数据用来判断是否还有下一页
+        next_cursor = None
+        if seek_filter is not None:
+            query = query.filter(seek_filter)
+        orders = query.limit(constants.USER_ORDER_PAGE_CAPACITY + 1).all()
+        if len(orders) > constants.USER_ORDER_PAGE_CAPACITY:
+            orders = orders[:constants.USER_ORDER_PAGE_CAPACITY]
+            next_cursor = encode_order_cursor(orders[-1])
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="查询订单信息失败")
@@ -105,7 +159,57 @@ def get_user_orders():
     if orders:
         for order in orders:
             orders_dict_list.append(order.to_dict())
-    return jsonify(errno=RET.OK, errmsg="OK", data={"orders": orders_dict_list})
+    return jsonify(errno=RET.OK, errmsg="OK", data={"orders": orders_dict_list, "next_cursor": next_cursor or ""})
+
+# 导出订单的字段
+ORDER_EXPORT_FIELDS = ("order_id", "title", "start_date", "end_date", "days", "amount", "status", "comment", "ctime")
+
+def _csv_line(values):
+    """把一行数据转换为csv格式，所有字段都加上引号"""
+    return u",".join(u'"%s"' % (u"%s" % value).replace(u'"', u'""') for value in values) + u"\r\n"
+
+@api.route("/user/orders/export", methods=["GET"])
+@login_required
+def export_user_orders():
+    """
+    导出用户的订单信息，format=csv|ndjson，role的含义与查询订单信息相同
+    使用数据库的服务端游标分批读取订单，边查询边通过生成器返回，内存占用与订单数量无关
+    """
+    user_id = g.user_id
+    role = request.args.get("role", "")
+    export_format = request.args.get("format", "csv")
+    if export_format not in ("csv", "ndjson"):
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    # 只查询需要的字段，不创建模型对象
+    query = db.session.query(Order.id, House.title, Order.begin_date, Order.end_date, Order.days, Order.amount,
+                             Order.status, Order.comment, Order.create_time).join(House, Order.house_id == House.id)
+    if "landlord" == role:
+        query = query.filter(House.user_id == user_id)
+    else:
+        query = query.filter(Order.user_id == user_id)
+    query = query.order_by(Order.create_time.desc(), Order.id.desc()) \
+        .execution_options(stream_results=True).yield_per(constants.ORDER_EXPORT_BATCH)
+
+    def generate():
+        if export_format == "csv":
+            # 带上BOM，excel打开时中文不会乱码
+            yield u"\ufeff" + _csv_line(ORDER_EXPORT_FIELDS)
+        for row in query:
+            values = (row.id, row.title, row.begin_date.strftime("%Y-%m-%d"), row.end_date.strftime("%Y-%m-%d"),
+                      row.days, row.amount, row.status, row.comment or "",
+                      row.create_time.strftime("%Y-%m-%d %H:%M:%S"))
+            if export_format == "csv":
+                yield _csv_line(values)
+            else:
+                yield json.dumps(dict(zip(ORDER_EXPORT_FIELDS, values))) + "\n"
+
+    if export_format == "csv":
+        mimetype = "text/csv"
+    else:
+        mimetype = "application/x-ndjson"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = "attachment; filename=orders.%s" % export_format
+    return response
 
 @api.route("/orders/<int:order_id>/status", methods=["PUT"])
 @login_required
@@ -120,26 +224,33 @@ def accept_reject_order(order_id):
     action = req_data.get("action")
     if action not in ("accept", "reject"):
         return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    # 拒单，要求用户传递拒单原因
+    reason = req_data.get("reason")
+    if action == "reject" and not reason:
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
     try:
         # 根据订单号查询订单，并且要求订单处于等待接单状态
-        order = Order.query.filter(Order.id == order_id, Order.status == "WAIT_ACCEPT").first()
-        house = order.house
+        # 锁定订单，避免与超时取消同时进行，超时取消提交后这里读到的是最新的状态
+        order = Order.query.filter(Order.id == order_id, Order.status == "WAIT_ACCEPT").with_for_update().first()
+        house = order.house if order else None
     except Exception as e:
         current_app.logger.error(e)
+        db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="无法获取订单数据")
     # 确保房东只能修改属于自己房子的订单
     if not order or house.user_id != user_id:
+        db.session.rollback()
         return jsonify(errno=RET.REQERR, errmsg="操作无效")
     if action == "accept":
         # 接单，将订单状态设置为等待评论
         order.status = "WAIT_COMMENT"
     elif action == "reject":
-        # 拒单，要求用户传递拒单原因
-        reason = req_data.get("reason")
-        if not reason:
-            return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
         order.status = "REJECTED"
         order.comment = reason
+        # 拒单后房屋的这段日期重新变为可预订，在同一个事务中记录事件，由后台worker释放日期
+        outbox.add_event("order_released", house_id=order.house_id,
+                         begin_date=order.begin_date.strftime("%Y-%m-%d"),
+                         end_date=order.end_date.strftime("%Y-%m-%d"))
     try:
         db.session.add(order)
         db.session.commit()
@@ -149,6 +260,74 @@ def accept_reject_order(order_id):
         return jsonify(errno=RET.DBERR, errmsg="操作失败")
     return jsonify(errno=RET.OK, errmsg="OK")
 
+@api.route("/orders/status", methods=["PUT"])
+@login_required
+def bulk_accept_reject_orders():
+    """
+    批量接单、拒单
+    请求参数orders为[{order_id, action, reason}]，使用一次连接查询检查订单，在一个事务中修改全部订单的状态
+    返回每个订单的处理结果
+    """
+    user_id = g.user_id
+    # 获取参数
+    req_data = request.get_json()
+    items = req_data.get("orders") if req_data else None
+    if not items or not isinstance(items, list):
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    if len(items) > constants.ORDER_BULK_MAX_COUNT:
+        return jsonify(errno=RET.PARAMERR, errmsg="订单数量超过上限")
+    # 检查每个订单的参数，results保存每个订单的处理结果
+    results = []
+    actions = {}
+    for item in items:
+        try:
+            order_id = int(item.get("order_id"))
+        except Exception as e:
+            current_app.logger.error(e)
+            results.append({"order_id": None, "errno": RET.PARAMERR, "errmsg": "参数错误"})
+            continue
+        action = item.get("action")
+        reason = item.get("reason")
+        result = {"order_id": order_id, "errno": RET.OK, "errmsg": "OK"}
+        results.append(result)
+        if order_id in actions or action not in ("accept", "reject") or (action == "reject" and not reason):
+            result.update(errno=RET.PARAMERR, errmsg="参数错误")
+            continue
+        actions[order_id] = (action, reason, result)
+    # 查询等待接单并且属于自己房子的订单，锁定这些订单，避免与超时取消同时进行
+    try:
+        orders = Order.query.join(Order.house).options(contains_eager(Order.house)) \
+            .filter(Order.id.in_(list(actions)), House.user_id == user_id, Order.status == "WAIT_ACCEPT") \
+            .with_for_update().all() if actions else []
+    except Exception as e:
+        current_app.logger.error(e)
+        db.session.rollback()
+        return jsonify(errno=RET.DBERR, errmsg="无法获取订单数据")
+    orders = dict((order.id, order) for order in orders)
+    for order_id, (action, reason, result) in actions.items():
+        order = orders.get(order_id)
+        # 确保房东只能修改属于自己房子的订单
+        if not order:
+            result.update(errno=RET.REQERR, errmsg="操作无效")
+        elif action == "accept":
+            # 接单，将订单状态设置为等待评论
+            order.status = "WAIT_COMMENT"
+        else:
+            # 拒单，保存拒单原因
+            order.status = "REJECTED"
+            order.comment = reason
+            # 拒单后房屋的这段日期重新变为可预订，在同一个事务中记录事件，由后台worker释放日期
+            outbox.add_event("order_released", house_id=order.house_id,
+                             begin_date=order.begin_date.strftime("%Y-%m-%d"),
+                             end_date=order.end_date.strftime("%Y-%m-%d"))
+    try:
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.error(e)
+        db.session.rollback()
+        return jsonify(errno=RET.DBERR, errmsg="操作失败")
+    return jsonify(errno=RET.OK, errmsg="OK", data={"results": results})
+
 @api.route("/orders/<int:order_id>/comment", methods=["PUT"])
 @login_required
 def save_order_comment(order_id):
@@ -179,15 +358,15 @@ def save_order_comment(order_id):
         house.order_count += 1
         db.session.add(order)
         db.session.add(house)
+        # 在同一个事务中记录事件，由后台worker处理缓存：
+        # 把新的评价追加到房屋评论列表的缓存和房屋详情缓存中，不再删除整个详情缓存
+        outbox.add_event("order_commented", order_id=order.id, house_id=house.id)
+        # 房屋的完成订单数发生了变化，更新房屋卡片、该城区的房屋列表缓存和成交次数排序索引
+        outbox.add_event("house_changed", house_id=house.id)
         db.session.commit()
     except Exception as e:
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="操作失败")
-    # 因为房屋详情中有订单的评价信息，为了让最新的评价信息展示在房屋详情中，所以删除redis中关于本订单房屋的详情缓存
-    try:
-        redis_store.delete("house_info_%s" % order.house.id)
-    except Exception as e:
-        current_app.logger.error(e)
 
     return jsonify(errno=RET.OK, errmsg="OK")
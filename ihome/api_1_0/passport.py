@@ -15,6 +15,8 @@ from ihome.utils.commons import login_required
 from ihome import db,constants
 # 导入七牛云
 from ihome.utils.image_storage import storage
+# 导入事务性发件箱
+from ihome.utils import outbox
 
 # 导入正则模块
 import re
@@ -142,6 +144,8 @@ def change_user_profile():
     # 更新用户的姓名信息
     try:
         User.query.filter_by(id=user_id).update({'name':name})
+        # 房屋详情和评论中有用户的昵称,在同一个事务中记录事件,由后台worker删除相关的缓存
+        outbox.add_event('user_name_changed',user_id=user_id)
         db.session.commit()
     except Exception as e:
         current_app.logger.error(e)
@@ -187,6 +191,8 @@ def set_user_avatar():
     try:
         # update()
         User.query.filter_by(id=user_id).update({'avatar_url':image_name})
+        # 房屋卡片和房屋详情中有房东的头像,在同一个事务中记录事件,由后台worker删除该用户发布的房屋的缓存
+        outbox.add_event('user_avatar_changed',user_id=user_id)
         db.session.commit()
     except Exception as e:
         current_app.logger.error(e)
@@ -18,8 +18,20 @@ HOME_PAGE_MAX_HOUSES = 5
 # 首页房屋数据的Redis缓存时间，单位：秒
 HOME_PAGE_DATA_REDIS_EXPIRES = 7200
 
-# 房屋详情页展示的评论最大数
-HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS = 30
+# 首页房屋数据的软过期时间，超过后仍返回缓存数据，同时在后台重建，单位：秒
+HOME_PAGE_DATA_SOFT_EXPIRES = 600
+
+# 房屋详情页展示的评论最大数，更多的评论通过评论列表接口分页获取
+HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS = 3
+
+# 房屋评论列表每页显示条目数
+HOUSE_COMMENT_PAGE_CAPACITY = 10
+
+# 房屋评论列表redis缓存的最大条数，更早的评论查询数据库
+HOUSE_COMMENT_REDIS_MAX_COUNT = 100
+
+# 房屋评论列表redis缓存时间，单位：秒
+HOUSE_COMMENT_REDIS_EXPIRES = 7200
 
 # 房屋详情页面数据Redis缓存时间，单位：秒
 HOUSE_DETAIL_REDIS_EXPIRE_SECOND = 7200
@@ -27,5 +39,119 @@ HOUSE_DETAIL_REDIS_EXPIRE_SECOND = 7200
 # 房屋列表页面每页显示条目数
 HOUSE_LIST_PAGE_CAPACITY = 2
 
-# 房屋列表页面Redis缓存时间，单位：秒
-HOUSE_LIST_REDIS_EXPIRES = 7200
+# 房屋列表页面Redis缓存时间，单位：秒，房屋或订单变化时通过版本号失效
+HOUSE_LIST_REDIS_EXPIRES = 86400
+
+# 会占用房屋日期的订单状态，已拒单和已取消的订单不再占用
+ORDER_BLOCKING_STATUS = ("WAIT_ACCEPT", "WAIT_PAYMENT", "PAID", "WAIT_COMMENT", "COMPLETE")
+
+# 已预订日期索引在日期过去之后的保留天数
+AVAILABILITY_INDEX_KEEP_DAYS = 1
+
+# 重建已预订日期索引时每批读取的订单数
+AVAILABILITY_INDEX_REBUILD_BATCH = 1000
+
+# 按日期搜索房屋时，已预订日期索引中冲突的房屋数不超过该值才直接使用房屋编号过滤
+AVAILABILITY_NOTIN_MAX_IDS = 200
+
+# 按日期搜索房屋时，日期范围不超过该天数才使用已预订日期索引，否则查询订单表
+AVAILABILITY_QUERY_MAX_DAYS = 60
+
+# 房屋卡片的Redis缓存时间，单位：秒
+HOUSE_CARD_REDIS_EXPIRES = 7200
+
+# 重建房屋排序索引时每批读取的房屋数
+HOUSE_RANK_REBUILD_BATCH = 1000
+
+# 进程内房屋目录的刷新间隔，单位：秒
+HOUSE_CATALOG_REFRESH_INTERVAL = 5
+
+# 批量获取房屋卡片时一次最多的房屋数量
+HOUSE_BATCH_MAX_COUNT = 50
+
+# 进程内房屋目录增量加载房屋设施时每批的房屋数
+HOUSE_CATALOG_FACILITY_BATCH = 500
+
+# 人数上限和房间数分桶位图的最大下限，更大的条件需要再与实际值比较
+HOUSE_CATALOG_BUCKET_MAX = 10
+
+# 房屋关键字搜索索引的刷新间隔，单位：秒
+HOUSE_SEARCH_REFRESH_INTERVAL = 5
+
+# 房屋关键字搜索最多返回的房屋数
+HOUSE_SEARCH_MAX_RESULTS = 1000
+
+# 房屋关键字搜索中标题的词相对地址的权重
+HOUSE_SEARCH_TITLE_WEIGHT = 3
+
+# 获取redis锁失败后重试的间隔，单位：秒
+LOCK_RETRY_INTERVAL = 0.05
+
+# 重建缓存的锁的过期时间，单位：毫秒
+CACHE_REBUILD_LOCK_EXPIRES = 5000
+
+# 缓存未命中且没有旧数据时，等待其它进程重建缓存的最长时间，单位：秒
+CACHE_REBUILD_WAIT = 1
+
+# 缓存的旧数据副本的有效期是缓存有效期的倍数
+CACHE_STALE_EXPIRES_FACTOR = 2
+
+# 进程内一级缓存最多缓存的数据条数
+LOCAL_CACHE_MAX_SIZE = 128
+
+# 进程内一级缓存的有效期，单位：秒
+LOCAL_CACHE_EXPIRES = 600
+
+# 进程内一级缓存的失效通知订阅断开后，重新订阅的间隔，单位：秒
+LOCAL_CACHE_RESUBSCRIBE_INTERVAL = 1
+
+# 响应体超过该大小时才进行gzip压缩，单位：字节
+GZIP_MIN_SIZE = 1024
+
+# gzip压缩等级
+GZIP_COMPRESS_LEVEL = 6
+
+# 压缩后的响应体的redis缓存有效期，单位：秒
+GZIP_REDIS_EXPIRES = 3600
+
+# 用户订单列表游标分页每页显示条目数
+USER_ORDER_PAGE_CAPACITY = 20
+
+# 导出订单时每批从数据库读取的订单数
+ORDER_EXPORT_BATCH = 500
+
+# 订单等待房东接单的最长时间，超过后自动取消，单位：秒
+ORDER_WAIT_ACCEPT_EXPIRES = 86400
+
+# 取消超时订单时每批处理的订单数
+ORDER_EXPIRE_BATCH = 200
+
+# 批量接单、拒单一次最多处理的订单数
+ORDER_BULK_MAX_COUNT = 100
+
+# 检查执行计划前写入测试数据时，每套房屋的订单数
+QUERY_PLAN_SEED_ORDERS_PER_HOUSE = 5
+
+# 检查执行计划前写入测试数据时，每个用户发布的房屋数
+QUERY_PLAN_SEED_HOUSES_PER_USER = 10
+
+# 写入测试数据时每批插入的行数
+QUERY_PLAN_SEED_BATCH = 1000
+
+# 房屋预订日历一次最多查询的月数
+HOUSE_CALENDAR_MAX_MONTHS = 6
+
+# 房屋预订日历redis缓存时间，单位：秒
+HOUSE_CALENDAR_REDIS_EXPIRES = 3600
+
+# 发件箱worker每批处理的事件数
+OUTBOX_BATCH = 100
+
+# 发件箱事件最多处理失败的次数，超过后不再处理
+OUTBOX_MAX_ATTEMPTS = 10
+
+# 发件箱worker没有待处理的事件时等待的时间，单位：秒
+OUTBOX_POLL_INTERVAL = 1
+
+# worker重建已预订日期索引和排序索引时锁的过期时间，单位：毫秒
+INDEX_REBUILD_LOCK_EXPIRES = 600000
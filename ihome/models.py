@@ -1,6 +1,7 @@
 # -*- coding:utf-8 -*-
 
 from datetime import datetime
+from sqlalchemy.orm import joinedload, subqueryload
 from werkzeug.security import generate_password_hash, check_password_hash
 from ihome import constants
 from . import db
@@ -94,6 +95,16 @@ class House(BaseModel, db.Model):
     """房屋信息"""
 
     __tablename__ = "ih_house_info"
+    __table_args__ = (
+        # 按城区过滤并按价格、成交次数、发布时间排序的房屋列表
+        db.Index("ix_house_area_price", "area_id", "price"),
+        db.Index("ix_house_area_order_count", "area_id", "order_count"),
+        db.Index("ix_house_area_ctime", "area_id", "create_time"),
+        # 首页按成交次数排序的房屋
+        db.Index("ix_house_order_count", "order_count"),
+        # 房屋目录和搜索索引按更新时间增量刷新
+        db.Index("ix_house_update_time", "update_time"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)  # 房屋编号
     user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False)  # 房屋主人的用户编号
@@ -115,6 +126,19 @@ class House(BaseModel, db.Model):
     images = db.relationship("HouseImage")  # 房屋的图片
     orders = db.relationship("Order", backref="house")  # 房屋的订单
 
+    @classmethod
+    def listing_query(cls):
+        """房屋列表使用的查询对象，同时加载城区和房东，to_basic_dict不再逐条查询"""
+        return cls.query.options(joinedload(cls.area), joinedload(cls.user))
+
+    @classmethod
+    def detail_query(cls):
+        """
+        房屋详情使用的查询对象，同时加载房东、图片和设施
+        加上to_full_dict中的评论查询，房屋详情固定只需要四次查询
+        """
+        return cls.query.options(joinedload(cls.user), subqueryload(cls.images), subqueryload(cls.facilities))
+
     def to_basic_dict(self):
         """将基本信息转换为字典数据"""
         house_dict = {
@@ -163,17 +187,11 @@ class House(BaseModel, db.Model):
             facilities.append(facility.id)
         house_dict["facilities"] = facilities
 
-        # 评论信息
+        # 评论信息，只包含最新的几条，更多的评论通过评论列表接口分页获取
         comments = []
-        orders = Order.query.filter(Order.house_id == self.id, Order.status == "COMPLETE", Order.comment != None) \
-            .order_by(Order.update_time.desc()).limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS)
+        orders = Order.comments_query(self.id).limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS)
         for order in orders:
-            comment = {
-                "comment": order.comment,  # 评论的内容
-                "user_name": order.user.name if order.user.name != order.user.mobile else "匿名用户",  # 发表评论的用户
-                "ctime": order.update_time.strftime("%Y-%m-%d %H:%M:%S")  # 评价的时间
-            }
-            comments.append(comment)
+            comments.append(order.to_comment_dict())
         house_dict["comments"] = comments
         return house_dict
 
@@ -201,6 +219,17 @@ class Order(BaseModel, db.Model):
     """订单"""
 
     __tablename__ = "ih_order_info"
+    __table_args__ = (
+        # 按房屋检查日期冲突的订单
+        db.Index("ix_order_house_status_date", "house_id", "status", "begin_date", "end_date"),
+        # 按房客或房屋查询订单列表
+        db.Index("ix_order_user_ctime", "user_id", "create_time", "id"),
+        db.Index("ix_order_house_ctime", "house_id", "create_time", "id"),
+        # 按房屋查询评论
+        db.Index("ix_order_house_status_utime", "house_id", "status", "update_time"),
+        # 按状态和创建时间查询超时未接单的订单
+        db.Index("ix_order_status_ctime", "status", "create_time"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)  # 订单编号
     user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False)  # 下订单的用户编号
@@ -223,6 +252,23 @@ class Order(BaseModel, db.Model):
         default="WAIT_ACCEPT", index=True)
     comment = db.Column(db.Text)  # 订单的评论信息或者拒单原因
 
+    @classmethod
+    def comments_query(cls, house_id):
+        """房屋评论的查询对象，按评价时间从新到旧排列，同时加载评论的用户"""
+        return cls.query.options(joinedload(cls.user)) \
+            .filter(cls.house_id == house_id, cls.status == "COMPLETE", cls.comment != None) \
+            .order_by(cls.update_time.desc(), cls.id.desc())
+
+    def to_comment_dict(self):
+        """将评论信息转换为字典数据"""
+        comment_dict = {
+            "order_id": self.id,
+            "comment": self.comment,  # 评论的内容
+            "user_name": self.user.name if self.user.name != self.user.mobile else "匿名用户",  # 发表评论的用户
+            "ctime": self.update_time.strftime("%Y-%m-%d %H:%M:%S")  # 评价的时间
+        }
+        return comment_dict
+
     def to_dict(self):
         """将订单信息转换为字典数据"""
         order_dict = {
@@ -239,3 +285,13 @@ class Order(BaseModel, db.Model):
         }
         return order_dict
 
+
+class OutboxEvent(BaseModel, db.Model):
+    """发件箱中待处理的领域事件"""
+
+    __tablename__ = "ih_outbox_event"
+
+    id = db.Column(db.Integer, primary_key=True)  # 事件编号
+    event_type = db.Column(db.String(32), nullable=False)  # 事件类型
+    payload = db.Column(db.Text, nullable=False)  # 事件数据，json格式
+    attempts = db.Column(db.Integer, default=0, nullable=False)  # 处理失败的次数
@@ -12,6 +12,33 @@ function decodeQuery(){
     }, {});
 }
 
+// 房屋详情中的评论数,与constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS一致,少于该数量时没有更多评价
+var detailCommentCount = 3;
+var commentsCursor = null; // 下一页评论的游标,null表示还没有从评论列表接口获取过评论
+var commentsQuerying = false; // 是否正在向后台获取评论
+
+// 使用游标分页获取下一页评论,第一页替换详情中的评论,之后的页追加到列表中
+function loadComments(houseId) {
+    if (commentsQuerying) return;
+    commentsQuerying = true;
+    var params = commentsCursor ? {cursor:commentsCursor} : {};
+    $.get("/api/v1.0/houses/" + houseId + "/comments", params, function(resp){
+        commentsQuerying = false;
+        if ("0" == resp.errno) {
+            var html = template("house-comments-tmpl", {comments:resp.data.comments});
+            if (null == commentsCursor) {
+                $(".house-comment-list").html(html);
+            } else {
+                $(".house-comment-list").append(html);
+            }
+            commentsCursor = resp.data.next_cursor;
+            if (!commentsCursor) {
+                $(".more-comments").hide();
+            }
+        }
+    });
+}
+
 $(document).ready(function(){
     // 获取详情页面要展示的房屋编号
     var queryData = decodeQuery();
@@ -22,6 +49,13 @@ $(document).ready(function(){
         if ("0" == resp.errno) {
             $(".swiper-container").html(template("house-image-tmpl", {img_urls:resp.data.house.img_urls, price:resp.data.house.price}));
             $(".detail-con").html(template("house-detail-tmpl", {house:resp.data.house}));
+            // 详情中只有最新的几条评价,点击查看更多时分页获取
+            if (resp.data.house.comments.length < detailCommentCount) {
+                $(".more-comments").hide();
+            }
+            $(".more-comments").on("click", function(){
+                loadComments(houseId);
+            });
 
             // resp.user_id为访问页面用户,resp.data.user_id为房东
             if (resp.data.user_id != resp.data.house.user_id) {
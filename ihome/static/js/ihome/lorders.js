@@ -9,78 +9,106 @@ function centerModals(){
     });
 }
 
+var next_cursor = ""; // 下一页的游标,首页为空
+var has_more = true; // 是否还有更多订单
+var orders_data_querying = false; // 是否正在向后台获取数据
+
 function getCookie(name) {
     var r = document.cookie.match("\\b" + name + "=([^;]*)\\b");
     return r ? r[1] : undefined;
 }
 
+// 使用游标分页获取下一页订单,追加到订单列表中
+function updateOrdersData() {
+    if (orders_data_querying || !has_more) return;
+    orders_data_querying = true;
+    // 查询房东的订单
+    $.get("/api/v1.0/user/orders", {role:"landlord", cursor:next_cursor}, function(resp){
+        orders_data_querying = false;
+        if ("0" == resp.errno) {
+            if ("" == next_cursor) {
+                $(".orders-list").html(template("orders-list-tmpl", {orders:resp.data.orders}));
+            } else {
+                $(".orders-list").append(template("orders-list-tmpl", {orders:resp.data.orders}));
+            }
+            next_cursor = resp.data.next_cursor;
+            has_more = !!next_cursor;
+        }
+    });
+}
+
 $(document).ready(function(){
     $('.modal').on('show.bs.modal', centerModals);      //当模态框出现的时候
     $(window).on('resize', centerModals);
-    // 查询房东的订单
-    $.get("/api/v1.0/user/orders?role=landlord", function(resp){
-        if ("0" == resp.errno) {
-            $(".orders-list").html(template("orders-list-tmpl", {orders:resp.data.orders}));
-            $(".order-accept").on("click", function(){
-                var orderId = $(this).parents("li").attr("order-id");
-                $(".modal-accept").attr("order-id", orderId);
-            });
-            // 接单处理
-            $(".modal-accept").on("click", function(){
-                var orderId = $(this).attr("order-id");
-                $.ajax({
-                    url:"/api/v1.0/orders/"+orderId+"/status",
-                    type:"PUT",
-                    data:'{"action":"accept"}',
-                    contentType:"application/json",
-                    dataType:"json",
-                    headers:{
-                        "X-CSRFTOKEN":getCookie("csrf_token"),
-                    },
-                    success:function (resp) {
-                        if ("4101" == resp.errno) {
-                            location.href = "/login.html";
-                        } else if ("0" == resp.errno) {
-                            $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已接单");
-                            $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
-                            $("#accept-modal").modal("hide");
-                        }
-                    }
-                })
-            });
-            $(".order-reject").on("click", function(){
-                var orderId = $(this).parents("li").attr("order-id");
-                $(".modal-reject").attr("order-id", orderId);
-            });
-            // 处理拒单
-            $(".modal-reject").on("click", function(){
-                var orderId = $(this).attr("order-id");
-                var reject_reason = $("#reject-reason").val();
-                if (!reject_reason) return;
-                var data = {
-                    action: "reject",
-                    reason:reject_reason
-                };
-                $.ajax({
-                    url:"/api/v1.0/orders/"+orderId+"/status",
-                    type:"PUT",
-                    data:JSON.stringify(data),
-                    contentType:"application/json",
-                    headers: {
-                        "X-CSRFTOKEN":getCookie("csrf_token")
-                    },
-                    dataType:"json",
-                    success:function (resp) {
-                        if ("4101" == resp.errno) {
-                            location.href = "/login.html";
-                        } else if ("0" == resp.errno) {
-                            $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已拒单");
-                            $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
-                            $("#reject-modal").modal("hide");
-                        }
-                    }
-                });
-            })
+    updateOrdersData();
+    // 滚动到页面底部时加载下一页
+    var windowHeight = $(window).height();
+    window.onscroll=function(){
+        var b = document.documentElement.scrollTop==0? document.body.scrollTop : document.documentElement.scrollTop;
+        var c = document.documentElement.scrollTop==0? document.body.scrollHeight : document.documentElement.scrollHeight;
+        if(c-b<windowHeight+50){
+            updateOrdersData();
         }
+    };
+    // 订单分页加载,使用事件委托为后加载的订单绑定事件
+    $(".orders-list").on("click", ".order-accept", function(){
+        var orderId = $(this).parents("li").attr("order-id");
+        $(".modal-accept").attr("order-id", orderId);
+    });
+    // 接单处理
+    $(".modal-accept").on("click", function(){
+        var orderId = $(this).attr("order-id");
+        $.ajax({
+            url:"/api/v1.0/orders/"+orderId+"/status",
+            type:"PUT",
+            data:'{"action":"accept"}',
+            contentType:"application/json",
+            dataType:"json",
+            headers:{
+                "X-CSRFTOKEN":getCookie("csrf_token"),
+            },
+            success:function (resp) {
+                if ("4101" == resp.errno) {
+                    location.href = "/login.html";
+                } else if ("0" == resp.errno) {
+                    $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已接单");
+                    $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
+                    $("#accept-modal").modal("hide");
+                }
+            }
+        })
+    });
+    $(".orders-list").on("click", ".order-reject", function(){
+        var orderId = $(this).parents("li").attr("order-id");
+        $(".modal-reject").attr("order-id", orderId);
     });
-});
\ No newline at end of file
+    // 处理拒单
+    $(".modal-reject").on("click", function(){
+        var orderId = $(this).attr("order-id");
+        var reject_reason = $("#reject-reason").val();
+        if (!reject_reason) return;
+        var data = {
+            action: "reject",
+            reason:reject_reason
+        };
+        $.ajax({
+            url:"/api/v1.0/orders/"+orderId+"/status",
+            type:"PUT",
+            data:JSON.stringify(data),
+            contentType:"application/json",
+            headers: {
+                "X-CSRFTOKEN":getCookie("csrf_token")
+            },
+            dataType:"json",
+            success:function (resp) {
+                if ("4101" == resp.errno) {
+                    location.href = "/login.html";
+                } else if ("0" == resp.errno) {
+                    $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已拒单");
+                    $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
+                    $("#reject-modal").modal("hide");
+                }
+            }
+        });
+    })
+});
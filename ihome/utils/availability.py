@@ -0,0 +1,116 @@
+# coding=utf-8
+# 房屋已预订日期索引
+# 在redis中为每一天维护一个集合,保存当天已被预订的房屋编号,
+# 按日期搜索房屋时只需对日期范围内的集合求并集,无需扫描订单表
+
+import datetime
+
+from ihome import redis_store, constants
+from ihome.utils import cache
+
+
+def _to_date(value):
+    """把datetime转换为date"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def _day_key(day):
+    """某一天的已预订房屋集合的键"""
+    return "booked_houses_%s" % day.strftime("%Y%m%d")
+
+
+def _iter_days(begin_date, end_date):
+    """遍历[begin_date, end_date]之间的每一天"""
+    day = _to_date(begin_date)
+    end_date = _to_date(end_date)
+    while day <= end_date:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def _expire_at(day):
+    """集合在日期过去之后自动过期,单位：时间戳"""
+    expire_day = day + datetime.timedelta(days=constants.AVAILABILITY_INDEX_KEEP_DAYS + 1)
+    return int((expire_day - datetime.date(1970, 1, 1)).total_seconds())
+
+
+def is_ready():
+    """索引是否已经完整建立"""
+    return bool(redis_store.get("availability_index_ready"))
+
+
+def invalidate():
+    """索引维护失败时撤销就绪标记,日期搜索回退到查询订单表"""
+    try:
+        redis_store.delete("availability_index_ready")
+    except Exception:
+        pass
+
+
+def calendar_key(house_id):
+    """房屋预订日历缓存的键"""
+    return "house_calendar_%s" % house_id
+
+
+def _update(house_id, begin_date, end_date, booked):
+    """
+    把房屋在[begin_date, end_date]期间的每一天加入或移出已预订集合
+    同时删除房屋的预订日历缓存
+    """
+    pip = redis_store.pipeline()
+    for day in _iter_days(begin_date, end_date):
+        key = _day_key(day)
+        if booked:
+            pip.sadd(key, house_id)
+            pip.expireat(key, _expire_at(day))
+        else:
+            pip.srem(key, house_id)
+    try:
+        pip.execute()
+    except Exception:
+        invalidate()
+        raise
+    finally:
+        cache.delete_values(calendar_key(house_id))
+
+
+def mark_booked(house_id, begin_date, end_date):
+    """记录房屋在[begin_date, end_date]期间已被预订"""
+    _update(house_id, begin_date, end_date, True)
+
+
+def release_booked(house_id, begin_date, end_date):
+    """订单被拒绝或取消后,释放房屋在[begin_date, end_date]期间的日期"""
+    _update(house_id, begin_date, end_date, False)
+
+
+def get_booked_house_ids(start_date, end_date):
+    """
+    查询在[start_date, end_date]期间有任意一天被预订的房屋编号
+    索引未就绪或者日期范围超过AVAILABILITY_QUERY_MAX_DAYS天时返回None,调用方需要回退到查询订单表
+    """
+    if (_to_date(end_date) - _to_date(start_date)).days >= constants.AVAILABILITY_QUERY_MAX_DAYS:
+        return None
+    if not is_ready():
+        return None
+    keys = [_day_key(day) for day in _iter_days(start_date, end_date)]
+    if not keys:
+        return set()
+    return set(int(house_id) for house_id in redis_store.sunion(keys))
+
+
+def rebuild():
+    """根据订单表重建索引,只需要处理尚未结束的订单"""
+    from ihome.models import Order
+
+    invalidate()
+    for key in redis_store.scan_iter("booked_houses_*"):
+        redis_store.delete(key)
+    today = datetime.date.today()
+    orders = Order.query.filter(Order.status.in_(constants.ORDER_BLOCKING_STATUS),
+                                Order.end_date >= today)
+    for order in orders.yield_per(constants.AVAILABILITY_INDEX_REBUILD_BATCH):
+        mark_booked(order.house_id, max(_to_date(order.begin_date), today), order.end_date)
+    redis_store.set("availability_index_ready", 1)
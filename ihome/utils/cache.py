@@ -0,0 +1,328 @@
+# coding=utf-8
+# 缓存辅助工具
+
+import hashlib
+import json
+import threading
+import time
+
+from flask import current_app, request, make_response
+from redis.exceptions import WatchError
+from ihome import redis_store, constants
+from ihome.utils import compress
+from ihome.utils.locks import RedisLock
+
+
+# 缓存的键中带上标签的版本号,数据变化时只需要让相关标签的版本号加1,
+# 旧版本号的缓存不会再被读取,等待过期即可
+
+def _generation_key(tag):
+    """标签版本号的键"""
+    return "cache_gen_%s" % tag
+
+
+def get_generations(*tags):
+    """批量获取标签的版本号,从未变化过的标签版本号为0"""
+    values = redis_store.mget([_generation_key(tag) for tag in tags])
+    return [int(value) if value else 0 for value in values]
+
+
+def bump_generations(*tags):
+    """标签对应的数据发生变化,让标签的版本号加1"""
+    pip = redis_store.pipeline()
+    for tag in tags:
+        pip.incr(_generation_key(tag))
+    pip.execute()
+
+
+def house_area_tag(area_id):
+    """
+    房屋列表缓存的城区标签
+    不限城区的列表使用houses_all标签,任意城区的房屋变化都会影响它
+    """
+    if area_id:
+        return "houses_area_%s" % area_id
+    return "houses_all"
+
+
+# 订单变化会影响按日期过滤的房屋列表
+HOUSE_BOOKING_TAG = "houses_booking"
+
+
+def houses_list_version(area_id, with_dates):
+    """房屋列表缓存键中的版本号部分"""
+    if with_dates:
+        area_gen, booking_gen = get_generations(house_area_tag(area_id), HOUSE_BOOKING_TAG)
+        return "g%s_b%s" % (area_gen, booking_gen)
+    area_gen, = get_generations(house_area_tag(area_id))
+    return "g%s" % area_gen
+
+
+def invalidate_houses_list(area_id=None, booking=False):
+    """
+    让受影响的房屋列表缓存失效
+    :param area_id: 房屋信息发生变化的城区编号
+    :param booking: 订单是否发生了变化
+    """
+    tags = []
+    if area_id:
+        tags.extend([house_area_tag(area_id), house_area_tag(None)])
+    if booking:
+        tags.append(HOUSE_BOOKING_TAG)
+    if tags:
+        bump_generations(*tags)
+
+
+def _house_card_key(house_id):
+    """房屋卡片缓存的键,卡片即house.to_basic_dict()的json数据"""
+    return "house_card_%s" % house_id
+
+
+def get_house_cards(house_ids):
+    """
+    批量获取房屋卡片
+    使用一次MGET读取缓存,未命中的房屋使用一次IN查询加载,再通过pipeline回填缓存
+    :return: 按house_ids顺序排列的卡片字典列表,不存在的房屋会被忽略
+    """
+    from ihome.models import House
+
+    if not house_ids:
+        return []
+    cards = {}
+    try:
+        values = redis_store.mget([_house_card_key(house_id) for house_id in house_ids])
+    except Exception as e:
+        current_app.logger.error(e)
+        values = [None] * len(house_ids)
+    for house_id, value in zip(house_ids, values):
+        if value:
+            cards[house_id] = json.loads(value)
+    missing_ids = [house_id for house_id in house_ids if house_id not in cards]
+    if missing_ids:
+        houses = House.listing_query().filter(House.id.in_(missing_ids)).all()
+        pip = redis_store.pipeline()
+        for house in houses:
+            card = house.to_basic_dict()
+            cards[house.id] = card
+            pip.setex(_house_card_key(house.id), constants.HOUSE_CARD_REDIS_EXPIRES, json.dumps(card))
+        try:
+            pip.execute()
+        except Exception as e:
+            current_app.logger.error(e)
+    return [cards[house_id] for house_id in house_ids if house_id in cards]
+
+
+def delete_house_cards(*house_ids):
+    """房屋信息变化后删除房屋卡片缓存"""
+    if house_ids:
+        redis_store.delete(*[_house_card_key(house_id) for house_id in house_ids])
+
+
+def _get(key):
+    """读取缓存,redis异常时视为未命中"""
+    try:
+        return redis_store.get(key)
+    except Exception as e:
+        current_app.logger.error(e)
+        return None
+
+
+def _stale_key(key):
+    """缓存的旧数据副本的键,有效期比缓存更长,缓存重建期间提供给其它请求"""
+    return "%s_stale" % key
+
+
+def _fresh_key(key):
+    """缓存新鲜标记的键,标记过期(软过期)后缓存仍然可用,但需要在后台重建"""
+    return "%s_fresh" % key
+
+
+def _etag_key(key):
+    """缓存数据的ETag的键,与缓存同时写入,命中缓存时不需要重新计算"""
+    return "%s_etag" % key
+
+
+def make_etag(value):
+    """根据缓存数据计算ETag"""
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+    return hashlib.md5(value).hexdigest()
+
+
+def _gzip_key(etag):
+    """压缩后的响应体的键,按ETag存储,响应体变化后ETag随之变化,不需要单独失效"""
+    return "gzip_%s" % etag
+
+
+def get_gzip_body(body, etag):
+    """获取压缩后的响应体,优先读取redis中已经压缩好的数据,避免每次请求重复压缩"""
+    key = _gzip_key(etag)
+    data = _get(key)
+    if data:
+        return data
+    data = compress.gzip_data(body)
+    try:
+        redis_store.setex(key, constants.GZIP_REDIS_EXPIRES, data)
+    except Exception as e:
+        current_app.logger.error(e)
+    return data
+
+
+def conditional_response(body, etag, cache_gzip=True):
+    """
+    构造带有ETag的响应,客户端的If-None-Match与ETag一致时返回304,不再发送响应体
+    客户端支持gzip时直接使用缓存中压缩好的响应体,响应体可能被压缩,使用弱ETag
+    :param cache_gzip: 是否把压缩后的响应体存入缓存,按用户区分的响应不存入,由after_request压缩
+    """
+    if etag and request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(body)
+        if etag and cache_gzip and compress.should_compress(len(body)):
+            compress.set_compressed(response, get_gzip_body(body, etag))
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def set_value(key, expires, value, soft_expires=None):
+    """
+    写入缓存,同时写入旧数据副本和ETag
+    :param expires: 缓存的有效期(硬过期),单位：秒
+    :param soft_expires: 缓存的新鲜期(软过期),单位：秒,为None时不区分软过期
+    :return: 缓存数据的ETag
+    """
+    pip = redis_store.pipeline()
+    etag = _write_value(pip, key, expires, value, soft_expires)
+    pip.execute()
+    return etag
+
+
+def _write_value(pip, key, expires, value, soft_expires=None):
+    """在pipeline中写入缓存、旧数据副本和ETag,返回ETag"""
+    etag = make_etag(value)
+    pip.setex(key, expires, value)
+    pip.setex(_etag_key(key), expires, etag)
+    pip.setex(_stale_key(key), expires * constants.CACHE_STALE_EXPIRES_FACTOR, value)
+    if soft_expires:
+        pip.setex(_fresh_key(key), soft_expires, 1)
+    return etag
+
+
+def delete_values(*keys):
+    """删除缓存,同时删除旧数据副本、ETag和新鲜标记,数据变化后不会再读到旧数据"""
+    if keys:
+        redis_store.delete(*[name for key in keys
+                             for name in (key, _stale_key(key), _etag_key(key), _fresh_key(key))])
+
+
+def update_value(key, expires, update):
+    """
+    原地修改缓存,不再删除后整体重建
+    使用WATCH保证修改期间缓存没有被其它请求改动,发生冲突时删除缓存,由下一次读取重建
+    :param update: 修改函数,参数和返回值都是json字符串,缓存不存在时不调用
+    """
+    with redis_store.pipeline() as pip:
+        try:
+            pip.watch(key)
+            value = pip.get(key)
+            if not value:
+                return
+            value = update(value)
+            pip.multi()
+            _write_value(pip, key, expires, value)
+            pip.execute()
+        except WatchError:
+            # 连同过期副本和ETag一起删除,避免读到修改前的旧数据
+            delete_values(key)
+
+
+def _refresh_in_background(key, expires, loader, soft_expires):
+    """在后台线程中重建缓存,同一时间只有获得重建锁的进程执行"""
+    lock = RedisLock("rebuild_%s" % key, constants.CACHE_REBUILD_LOCK_EXPIRES)
+    if not lock.acquire():
+        return
+    app = current_app._get_current_object()
+
+    def refresh():
+        with app.app_context():
+            try:
+                value = loader()
+                if value is not None:
+                    set_value(key, expires, value, soft_expires)
+            except Exception as e:
+                app.logger.error(e)
+            finally:
+                try:
+                    lock.release()
+                except Exception as e:
+                    app.logger.error(e)
+
+    thread = threading.Thread(target=refresh)
+    thread.daemon = True
+    thread.start()
+
+
+def get_or_load_with_etag(key, expires, loader, soft_expires=None):
+    """
+    cache-aside方式读取缓存,并且保证同一时间只有一个进程重建缓存(single-flight)
+    缓存未命中时,获得重建锁的进程调用loader并写入缓存;
+    其它进程直接返回旧数据副本,没有旧数据时短暂等待缓存写入,等待超时后再自己调用loader
+    指定soft_expires时,缓存超过软过期时间后仍然立即返回,同时在后台线程中重建(stale-while-revalidate)
+    命中缓存时ETag与缓存一起读取,读取旧数据副本等少数情况下重新计算
+    :param loader: 从数据库加载数据的函数,返回json字符串,返回None表示没有数据,不写入缓存
+    :return: (json字符串或None, ETag或None)
+    """
+    fresh = True
+    try:
+        if soft_expires:
+            value, etag, fresh = redis_store.mget([key, _etag_key(key), _fresh_key(key)])
+        else:
+            value, etag = redis_store.mget([key, _etag_key(key)])
+    except Exception as e:
+        current_app.logger.error(e)
+        value, etag = None, None
+    if value:
+        current_app.logger.info("hit redis %s" % key)
+        if not fresh:
+            try:
+                _refresh_in_background(key, expires, loader, soft_expires)
+            except Exception as e:
+                current_app.logger.error(e)
+        return value, etag or make_etag(value)
+    lock = RedisLock("rebuild_%s" % key, constants.CACHE_REBUILD_LOCK_EXPIRES)
+    try:
+        acquired = lock.acquire()
+    except Exception as e:
+        current_app.logger.error(e)
+        acquired = True
+    if not acquired:
+        value = _get(_stale_key(key))
+        if value:
+            return value, make_etag(value)
+        deadline = time.time() + constants.CACHE_REBUILD_WAIT
+        while time.time() < deadline:
+            time.sleep(constants.LOCK_RETRY_INTERVAL)
+            value = _get(key)
+            if value:
+                return value, make_etag(value)
+    try:
+        # 获得锁之后再检查一次,其它进程可能刚刚完成重建
+        value = _get(key) if acquired else None
+        if value:
+            return value, make_etag(value)
+        value = loader()
+        if value is None:
+            return None, None
+        try:
+            etag = set_value(key, expires, value, soft_expires)
+        except Exception as e:
+            current_app.logger.error(e)
+            etag = make_etag(value)
+        return value, etag
+    finally:
+        try:
+            lock.release()
+        except Exception as e:
+            current_app.logger.error(e)
+
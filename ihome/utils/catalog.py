@@ -0,0 +1,267 @@
+# coding=utf-8
+# 进程内的房屋目录
+# 每个进程在内存中保存房屋列表搜索用到的字段的列式快照,
+# 按照update_time增量刷新,过滤/排序/分页都使用numpy的向量化运算完成;
+# 同时为每种设施维护一个位图,为人数上限和房间数维护分桶位图,用于分面搜索
+
+import threading
+import time
+
+import numpy as np
+
+from ihome import db, constants
+from ihome.utils import availability, house_index
+
+
+class HouseCatalog(object):
+    """房屋搜索字段的列式快照"""
+
+    # 列名和数据类型
+    COLUMNS = (
+        ("id", np.int64),
+        ("area_id", np.int32),
+        ("price", np.int64),
+        ("order_count", np.int32),
+        ("create_time", np.float64),
+        ("capacity", np.int32),
+        ("room_count", np.int32),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 保证同一时间只有一个线程从数据库加载
+        self._refresh_lock = threading.Lock()
+        self._size = 0
+        self._columns = dict((name, np.zeros(0, dtype=dtype)) for name, dtype in self.COLUMNS)
+        # 房屋编号到行号的映射
+        self._rows = {}
+        # 已经加载的最新的update_time
+        self._last_update_time = None
+        # 上一次刷新的时间戳
+        self._last_refresh = 0
+        # 设施编号到位图的映射,位图的第row位表示该行的房屋拥有该设施
+        self._facilities = {}
+        # 分桶位图的缓存,键为(列名, 下限),目录刷新后清空
+        self._buckets = {}
+
+    def _reserve(self, size):
+        """保证每一列至少能容纳size行,容量不足时按倍数扩容"""
+        capacity = len(self._columns["id"])
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 1024)
+        for name, dtype in self.COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = column
+        for facility_id, bitmap in self._facilities.items():
+            self._facilities[facility_id] = self._grow_bitmap(bitmap, capacity)
+
+    @staticmethod
+    def _grow_bitmap(bitmap, capacity):
+        """把位图扩容到capacity位"""
+        grown = np.zeros(capacity, dtype=bool)
+        grown[:len(bitmap)] = bitmap
+        return grown
+
+    def _load_facilities(self, house_ids):
+        """
+        加载房屋的设施,house_ids为None时加载全部房屋
+        :return: [(房屋编号, 设施编号)]
+        """
+        from ihome.models import house_facility
+
+        query = db.session.query(house_facility.c.house_id, house_facility.c.facility_id)
+        if house_ids is None:
+            return query.all()
+        rows = []
+        batch = constants.HOUSE_CATALOG_FACILITY_BATCH
+        for start in range(0, len(house_ids), batch):
+            rows.extend(query.filter(house_facility.c.house_id.in_(house_ids[start:start + batch])).all())
+        return rows
+
+    def refresh(self, force=False):
+        """增量加载update_time之后变化的房屋,两次刷新之间至少间隔HOUSE_CATALOG_REFRESH_INTERVAL秒"""
+        now = time.time()
+        if not force and now - self._last_refresh < constants.HOUSE_CATALOG_REFRESH_INTERVAL:
+            return
+        # 同一时间只有一个线程查询数据库;首次加载时其它线程等待加载完成,之后刷新时其它线程直接使用旧的快照
+        if not self._refresh_lock.acquire(force or not self._last_refresh):
+            return
+        try:
+            if not force and time.time() - self._last_refresh < constants.HOUSE_CATALOG_REFRESH_INTERVAL:
+                return
+            self._load(now)
+        finally:
+            self._refresh_lock.release()
+
+    def _load(self, now):
+        """查询数据库,把变化的房屋写入快照"""
+        from ihome.models import House
+
+        query = db.session.query(House.id, House.area_id, House.price, House.order_count, House.create_time,
+                                 House.capacity, House.room_count, House.update_time)
+        if self._last_update_time is not None:
+            # 使用>=避免漏掉同一秒内的修改,重复加载的行会被原地覆盖
+            query = query.filter(House.update_time >= self._last_update_time)
+        houses = query.all()
+        if self._last_update_time is None:
+            facility_rows = self._load_facilities(None)
+        else:
+            facility_rows = self._load_facilities([house.id for house in houses]) if houses else []
+        with self._lock:
+            self._reserve(self._size + len(houses))
+            for house in houses:
+                row = self._rows.get(house.id)
+                if row is None:
+                    row = self._size
+                    self._rows[house.id] = row
+                    self._size += 1
+                self._columns["id"][row] = house.id
+                self._columns["area_id"][row] = house.area_id
+                self._columns["price"][row] = house.price or 0
+                self._columns["order_count"][row] = house.order_count or 0
+                self._columns["create_time"][row] = time.mktime(house.create_time.timetuple())
+                self._columns["capacity"][row] = house.capacity or 0
+                self._columns["room_count"][row] = house.room_count or 0
+                if self._last_update_time is None or house.update_time > self._last_update_time:
+                    self._last_update_time = house.update_time
+                # 先清除房屋原有的设施,再按照最新的数据设置
+                for bitmap in self._facilities.values():
+                    bitmap[row] = False
+            for house_id, facility_id in facility_rows:
+                bitmap = self._facilities.get(facility_id)
+                if bitmap is None:
+                    bitmap = np.zeros(len(self._columns["id"]), dtype=bool)
+                    self._facilities[facility_id] = bitmap
+                row = self._rows.get(house_id)
+                # 两次查询之间新发布的房屋,等待下一次刷新再加载
+                if row is not None:
+                    bitmap[row] = True
+            if houses:
+                self._buckets = {}
+            self._last_refresh = now
+
+    def _at_least(self, name, value):
+        """
+        某一列的值不小于value的分桶位图
+        超过HOUSE_CATALOG_BUCKET_MAX的值落在同一个桶中,需要再与实际值比较
+        """
+        bucket = min(value, constants.HOUSE_CATALOG_BUCKET_MAX)
+        bitmap = self._buckets.get((name, bucket))
+        if bitmap is None:
+            bitmap = self._columns[name][:self._size] >= bucket
+            self._buckets[(name, bucket)] = bitmap
+        if value > bucket:
+            return bitmap & (self._columns[name][:self._size] >= value)
+        return bitmap
+
+    def _filter(self, area_id, excluded_ids, facility_ids=None, min_price=None, max_price=None,
+                min_capacity=None, min_room_count=None):
+        """按照过滤条件计算符合条件的房屋位图"""
+        size = self._size
+        mask = np.ones(size, dtype=bool)
+        if area_id:
+            mask &= self._columns["area_id"][:size] == int(area_id)
+        if excluded_ids:
+            mask &= ~np.in1d(self._columns["id"][:size], np.array(list(excluded_ids), dtype=np.int64))
+        for facility_id in facility_ids or []:
+            bitmap = self._facilities.get(facility_id)
+            if bitmap is None:
+                return np.zeros(size, dtype=bool)
+            mask &= bitmap[:size]
+        if min_price is not None:
+            mask &= self._columns["price"][:size] >= min_price
+        if max_price is not None:
+            mask &= self._columns["price"][:size] <= max_price
+        if min_capacity:
+            mask &= self._at_least("capacity", min_capacity)
+        if min_room_count:
+            mask &= self._at_least("room_count", min_room_count)
+        return mask
+
+    def _page(self, mask, sort_key, page, capacity):
+        """对符合条件的房屋排序并分页"""
+        ids = self._columns["id"][:self._size]
+        selected = np.nonzero(mask)[0]
+        field, descending = house_index.SORT_FIELDS.get(sort_key, house_index.SORT_FIELDS["new"])
+        # 先按排序字段,再按房屋编号排序,与数据库查询的顺序一致
+        order = np.lexsort((ids[selected], self._columns[field][:self._size][selected]))
+        if descending:
+            order = order[::-1]
+        start = (max(page, 1) - 1) * capacity
+        page_rows = selected[order[start:start + capacity]]
+        return [int(house_id) for house_id in ids[page_rows]], len(selected)
+
+    def search(self, area_id=None, excluded_ids=None, sort_key="new", page=1,
+               capacity=constants.HOUSE_LIST_PAGE_CAPACITY):
+        """
+        过滤、排序并分页
+        :param area_id: 城区编号,为空表示不限
+        :param excluded_ids: 需要排除的房屋编号,例如日期冲突的房屋
+        :return: (当前页的房屋编号列表, 符合条件的房屋总数)
+        """
+        with self._lock:
+            mask = self._filter(area_id, excluded_ids)
+            return self._page(mask, sort_key, page, capacity)
+
+    def facet_search(self, area_id=None, excluded_ids=None, facility_ids=None, min_price=None, max_price=None,
+                     min_capacity=None, min_room_count=None, sort_key="new", page=1,
+                     capacity=constants.HOUSE_LIST_PAGE_CAPACITY):
+        """
+        分面搜索,设施条件是设施位图的与运算,人数上限和房间数使用分桶位图
+        :return: (当前页的房屋编号列表, 符合条件的房屋总数, {设施编号: 符合条件的房屋中拥有该设施的数量})
+        """
+        with self._lock:
+            mask = self._filter(area_id, excluded_ids, facility_ids, min_price, max_price,
+                                min_capacity, min_room_count)
+            houses_ids, total = self._page(mask, sort_key, page, capacity)
+            facets = dict((facility_id, int(np.count_nonzero(mask & bitmap[:self._size])))
+                          for facility_id, bitmap in self._facilities.items())
+            return houses_ids, total, facets
+
+
+# 每个进程一份房屋目录
+house_catalog = HouseCatalog()
+
+
+def search_page(area_id, start_date, end_date, sort_key, page, capacity=constants.HOUSE_LIST_PAGE_CAPACITY):
+    """
+    使用房屋目录获取一页房屋编号
+    按日期过滤需要已预订日期索引,无法使用时返回None,调用方需要回退到查询数据库
+    :return: (房屋编号列表, 房屋总数)
+    """
+    excluded_ids = None
+    if start_date or end_date:
+        if not (start_date and end_date):
+            return None
+        excluded_ids = availability.get_booked_house_ids(start_date, end_date)
+        if excluded_ids is None:
+            return None
+    house_catalog.refresh()
+    return house_catalog.search(area_id, excluded_ids, sort_key, page, capacity)
+
+
+def facet_search_page(area_id, start_date, end_date, sort_key, page, facet_filters,
+                      capacity=constants.HOUSE_LIST_PAGE_CAPACITY):
+    """
+    使用房屋目录进行分面搜索
+    已预订日期索引无法使用时,使用一次去重查询获取日期冲突的房屋
+    :param facet_filters: facility_ids/min_price/max_price/min_capacity/min_room_count组成的字典
+    :return: (房屋编号列表, 房屋总数, 设施计数)
+    """
+    from ihome.models import Order
+
+    excluded_ids = None
+    if start_date and end_date:
+        excluded_ids = availability.get_booked_house_ids(start_date, end_date)
+    if (start_date or end_date) and excluded_ids is None:
+        conflict_filter = [Order.status.in_(constants.ORDER_BLOCKING_STATUS)]
+        if end_date:
+            conflict_filter.append(Order.begin_date <= end_date)
+        if start_date:
+            conflict_filter.append(Order.end_date >= start_date)
+        excluded_ids = set(house_id for house_id, in db.session.query(Order.house_id).filter(*conflict_filter).distinct())
+    house_catalog.refresh()
+    return house_catalog.facet_search(area_id, excluded_ids, sort_key=sort_key, page=page, capacity=capacity,
+                                      **facet_filters)
@@ -0,0 +1,134 @@
+# coding=utf-8
+# 房屋评论列表
+# 每套房屋最新的HOUSE_COMMENT_REDIS_MAX_COUNT条评论缓存在redis的列表中,从新到旧排列,
+# 发表评论时追加到列表头部并修改房屋详情缓存中的评论,不再删除缓存;更早的评论直接查询数据库
+
+import datetime
+import json
+
+from redis.exceptions import WatchError
+from ihome import db, redis_store, constants
+from ihome.utils import cache
+from ihome.utils.commons import encode_cursor, decode_cursor
+
+
+def _comments_key(house_id):
+    """房屋评论列表缓存的键"""
+    return "house_comments_%s" % house_id
+
+
+def encode_comment_cursor(comment):
+    """把页面最后一条评论的评价时间和订单编号编码为游标字符串"""
+    return encode_cursor([comment["ctime"], comment["order_id"]])
+
+
+def decode_comment_cursor(cursor):
+    """解析游标字符串,返回(评价时间字符串, 订单编号)"""
+    ctime, order_id = decode_cursor(cursor)
+    # 检查时间格式
+    datetime.datetime.strptime(ctime, "%Y-%m-%d %H:%M:%S")
+    return ctime, int(order_id)
+
+
+def _is_after(comment, cursor):
+    """评论是否排在游标之后"""
+    ctime, order_id = cursor
+    return comment["ctime"] < ctime or (comment["ctime"] == ctime and comment["order_id"] < order_id)
+
+
+def load_comments(house_id, cursor=None, count=constants.HOUSE_COMMENT_PAGE_CAPACITY):
+    """查询数据库,获取游标之后的评论"""
+    from ihome.models import Order
+
+    query = Order.comments_query(house_id)
+    if cursor is not None:
+        ctime, order_id = cursor
+        update_time = datetime.datetime.strptime(ctime, "%Y-%m-%d %H:%M:%S")
+        query = query.filter(db.or_(Order.update_time < update_time,
+                                    db.and_(Order.update_time == update_time, Order.id < order_id)))
+    return [order.to_comment_dict() for order in query.limit(count)]
+
+
+def _get_cached_comments(house_id):
+    """读取缓存的评论列表,缓存不存在时查询数据库重建"""
+    key = _comments_key(house_id)
+    values = redis_store.lrange(key, 0, -1)
+    if values:
+        return [json.loads(value) for value in values]
+    comments = load_comments(house_id, count=constants.HOUSE_COMMENT_REDIS_MAX_COUNT)
+    if comments:
+        pip = redis_store.pipeline()
+        pip.delete(key)
+        pip.rpush(key, *[json.dumps(comment) for comment in comments])
+        pip.expire(key, constants.HOUSE_COMMENT_REDIS_EXPIRES)
+        pip.execute()
+    return comments
+
+
+def get_comments_page(house_id, cursor=None, count=constants.HOUSE_COMMENT_PAGE_CAPACITY):
+    """
+    获取一页评论,优先使用缓存的评论列表,超出缓存范围的评论查询数据库
+    :param cursor: decode_comment_cursor解析后的游标,为None表示第一页
+    :return: (评论列表, 下一页的游标,没有更多评论时为None)
+    """
+    comments = _get_cached_comments(house_id)
+    # 评论数少于缓存的最大条数时,缓存中包含了全部评论
+    cached_all = len(comments) < constants.HOUSE_COMMENT_REDIS_MAX_COUNT
+    if cursor is not None:
+        comments = [comment for comment in comments if _is_after(comment, cursor)]
+    # 多取一条评论用来判断是否还有下一页
+    page = comments[:count + 1]
+    if len(page) <= count and not cached_all:
+        # 缓存中的评论不够一页,并且缓存之外还有更早的评论
+        page = load_comments(house_id, cursor, count + 1)
+    next_cursor = None
+    if len(page) > count:
+        page = page[:count]
+        next_cursor = encode_comment_cursor(page[-1])
+    return page, next_cursor
+
+
+def _sort_key(comment):
+    """评论从新到旧排列的排序键"""
+    return comment["ctime"], comment["order_id"]
+
+
+def add_comment(order):
+    """
+    发表评论后把评论追加到评论列表缓存的头部,并修改房屋详情缓存中的评论
+    评论列表缓存不存在时不处理,由下一次读取重建;按订单编号去重,重复执行不会产生重复的评论
+    """
+    comment = order.to_comment_dict()
+    key = _comments_key(order.house_id)
+    with redis_store.pipeline() as pip:
+        try:
+            pip.watch(key)
+            values = [json.loads(value) for value in pip.lrange(key, 0, -1)]
+            # 缓存在提交之后重建过,已经包含了这条评论
+            if values and not any(value["order_id"] == comment["order_id"] for value in values):
+                pip.multi()
+                if _sort_key(values[0]) > _sort_key(comment):
+                    # 已经有更新的评论,追加到头部会打乱顺序,删除缓存由下一次读取重建
+                    pip.delete(key)
+                else:
+                    pip.lpush(key, json.dumps(comment))
+                    pip.ltrim(key, 0, constants.HOUSE_COMMENT_REDIS_MAX_COUNT - 1)
+                pip.execute()
+        except WatchError:
+            # 执行期间评论列表被修改,删除缓存由下一次读取重建
+            redis_store.delete(key)
+
+    def add_to_detail(house_json):
+        house_dict = json.loads(house_json)
+        comments = [value for value in house_dict.get("comments", []) if value["order_id"] != comment["order_id"]]
+        comments.append(comment)
+        comments.sort(key=_sort_key, reverse=True)
+        house_dict["comments"] = comments[:constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS]
+        return json.dumps(house_dict)
+    cache.update_value("house_info_%s" % order.house_id, constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND, add_to_detail)
+
+
+def delete_comments(house_id):
+    """删除房屋的评论列表缓存和房屋详情缓存,由下一次读取重建"""
+    redis_store.delete(_comments_key(house_id))
+    cache.delete_values("house_info_%s" % house_id)
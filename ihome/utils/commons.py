@@ -1,6 +1,8 @@
 # coding=utf-8
 
+import base64
 import functools
+import json
 
 from flask import g, session, jsonify
 from werkzeug.routing import BaseConverter
@@ -24,4 +26,17 @@ def login_required(f):
         else:
             g.user_id = user_id
             return f(*args, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def encode_cursor(values):
+    """把分页游标中的值(页面最后一条数据的排序值和编号)编码为url安全的字符串"""
+    cursor_json = json.dumps(values)
+    return base64.urlsafe_b64encode(cursor_json.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析encode_cursor编码的游标字符串,返回值列表,格式错误时抛出异常"""
+    cursor = str(cursor)
+    cursor_json = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    return json.loads(cursor_json.decode("utf-8"))
@@ -0,0 +1,51 @@
+# coding=utf-8
+# 响应压缩
+# 客户端支持gzip并且响应体超过阈值时压缩json和文本响应体,流式响应不压缩
+
+import gzip
+import io
+
+from flask import request
+from ihome import constants
+
+
+def gzip_data(data):
+    """使用gzip压缩数据"""
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=constants.GZIP_COMPRESS_LEVEL) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def should_compress(size):
+    """客户端支持gzip并且数据超过阈值时才压缩,小数据压缩后反而可能变大"""
+    return size >= constants.GZIP_MIN_SIZE and request.accept_encodings["gzip"] > 0
+
+
+def set_compressed(response, data):
+    """把压缩后的数据写入响应"""
+    response.set_data(data)
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+
+
+def is_compressible(mimetype):
+    """只压缩json和文本,图片等已经压缩过的格式再压缩没有收益"""
+    return mimetype == "application/json" or (mimetype or "").startswith("text/")
+
+
+def compress_response(response):
+    """
+    压缩响应体
+    已经压缩过(例如使用了缓存中的压缩数据)、流式响应、非200的响应和json/文本之外的响应不处理
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or not is_compressible(response.mimetype)):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if should_compress(len(data)):
+        set_compressed(response, gzip_data(data))
+    return response
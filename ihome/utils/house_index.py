@@ -0,0 +1,115 @@
+# coding=utf-8
+# 房屋列表排序索引
+# 为每个排序字段在redis中维护有序集合,全部房屋一个,每个城区一个,
+# 不按日期过滤的房屋列表直接从有序集合中分页获取房屋编号
+
+import time
+
+from ihome import redis_store, constants
+
+
+# 排序条件对应的有序集合字段和排序方向(是否降序)
+SORT_FIELDS = {
+    "booking": ("order_count", True),
+    "price-inc": ("price", False),
+    "price-des": ("price", True),
+    "new": ("create_time", True),
+}
+
+
+def _rank_key(field, area_id=None):
+    """排序字段的有序集合的键"""
+    if area_id:
+        return "house_rank_%s_%s" % (field, area_id)
+    return "house_rank_%s" % field
+
+
+def _member(house_id):
+    """
+    有序集合的成员,分值相同的成员按字符串排序,房屋编号补零到固定长度后字符串顺序与数值顺序一致,
+    与数据库查询分值相同时按房屋编号排序的结果相同
+    """
+    return "%010d" % house_id
+
+
+def _house_scores(house):
+    """房屋在各个有序集合中的分值"""
+    return {
+        "order_count": house.order_count or 0,
+        "price": house.price or 0,
+        "create_time": time.mktime(house.create_time.timetuple()),
+    }
+
+
+def is_ready():
+    """排序索引是否已经完整建立"""
+    return bool(redis_store.get("house_rank_ready"))
+
+
+def invalidate():
+    """索引维护失败时撤销就绪标记,房屋列表回退到查询数据库"""
+    try:
+        redis_store.delete("house_rank_ready")
+    except Exception:
+        pass
+
+
+def _execute(pip):
+    """执行索引的更新,失败时撤销就绪标记"""
+    try:
+        pip.execute()
+    except Exception:
+        invalidate()
+        raise
+
+
+def _add_house(pip, house):
+    """把房屋加入全部房屋和所属城区的有序集合"""
+    for field, score in _house_scores(house).items():
+        # 使用原始命令,兼容不同版本redis客户端的zadd参数
+        pip.execute_command("ZADD", _rank_key(field), score, _member(house.id))
+        pip.execute_command("ZADD", _rank_key(field, house.area_id), score, _member(house.id))
+
+
+def index_house(house):
+    """房屋新增或修改后更新排序索引"""
+    pip = redis_store.pipeline()
+    _add_house(pip, house)
+    _execute(pip)
+
+
+def get_page(area_id, sort_key, page, capacity):
+    """
+    从有序集合中获取一页房屋编号
+    索引未就绪时返回None,调用方需要回退到查询数据库
+    :return: (房屋编号列表, 房屋总数)
+    """
+    if not is_ready():
+        return None
+    field, descending = SORT_FIELDS.get(sort_key, SORT_FIELDS["new"])
+    key = _rank_key(field, area_id)
+    start = (max(page, 1) - 1) * capacity
+    pip = redis_store.pipeline()
+    if descending:
+        pip.zrevrange(key, start, start + capacity - 1)
+    else:
+        pip.zrange(key, start, start + capacity - 1)
+    pip.zcard(key)
+    house_ids, total = pip.execute()
+    return [int(house_id) for house_id in house_ids], total
+
+
+def rebuild():
+    """根据房屋表重建排序索引"""
+    from ihome.models import House
+
+    invalidate()
+    for key in redis_store.scan_iter("house_rank_*"):
+        redis_store.delete(key)
+    pip = redis_store.pipeline()
+    for index, house in enumerate(House.query.yield_per(constants.HOUSE_RANK_REBUILD_BATCH)):
+        _add_house(pip, house)
+        if (index + 1) % constants.HOUSE_RANK_REBUILD_BATCH == 0:
+            pip.execute()
+    pip.execute()
+    redis_store.set("house_rank_ready", 1)
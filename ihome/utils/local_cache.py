@@ -0,0 +1,119 @@
+# coding=utf-8
+# 进程内的一级缓存
+# 城区、设施等几乎不变的参考数据直接缓存在每个进程的内存中,按TTL过期并限制数量,
+# 数据变化时通过redis的发布订阅通知所有进程删除各自的缓存
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from ihome import redis_store, constants
+
+
+# 参考数据失效通知的频道
+INVALIDATE_CHANNEL = "ihome_reference_invalidate"
+
+
+class LocalCache(object):
+    """按TTL过期,超过容量时淘汰最久未使用的数据的进程内缓存"""
+
+    def __init__(self, max_size, expires):
+        """
+        :param max_size: 最多缓存的数据条数
+        :param expires: 数据的有效期,单位：秒
+        """
+        self.max_size = max_size
+        self.expires = expires
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """获取缓存数据,不存在或已过期时返回None"""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return None
+            value, expire_at = item
+            if expire_at < time.time():
+                return None
+            # 重新插入到末尾,末尾是最近使用的数据
+            self._data[key] = item
+            return value
+
+    def set(self, key, value):
+        """写入缓存数据,超过容量时淘汰最久未使用的数据"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + self.expires)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        """删除缓存数据"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存数据"""
+        with self._lock:
+            self._data.clear()
+
+
+# 每个进程一份参考数据缓存
+reference_cache = LocalCache(constants.LOCAL_CACHE_MAX_SIZE, constants.LOCAL_CACHE_EXPIRES)
+
+_listener_lock = threading.Lock()
+_listener_started = False
+
+
+def _listen_invalidation(app):
+    """订阅失效通知,收到通知后删除本进程的缓存,连接断开后重新订阅"""
+    while True:
+        try:
+            pubsub = redis_store.pubsub()
+            pubsub.subscribe(INVALIDATE_CHANNEL)
+            for message in pubsub.listen():
+                if message.get("type") == "message":
+                    reference_cache.delete(*json.loads(message["data"]))
+        except Exception as e:
+            app.logger.error(e)
+        # 重新订阅前清空缓存,避免断开期间错过的通知
+        reference_cache.clear()
+        time.sleep(constants.LOCAL_CACHE_RESUBSCRIBE_INTERVAL)
+
+
+def _ensure_listener():
+    """在进程第一次使用缓存时启动订阅线程,兼容先创建应用再fork出工作进程的部署方式"""
+    global _listener_started
+    if _listener_started:
+        return
+    with _listener_lock:
+        if _listener_started:
+            return
+        thread = threading.Thread(target=_listen_invalidation, args=(current_app._get_current_object(),))
+        thread.daemon = True
+        thread.start()
+        _listener_started = True
+
+
+def get_or_load(key, loader):
+    """
+    读取进程内缓存,未命中时调用loader加载并写入缓存
+    loader返回None表示没有数据,不写入缓存
+    """
+    _ensure_listener()
+    value = reference_cache.get(key)
+    if value is None:
+        value = loader()
+        if value is not None:
+            reference_cache.set(key, value)
+    return value
+
+
+def publish_invalidation(*keys):
+    """通知所有进程删除参考数据的缓存"""
+    reference_cache.delete(*keys)
+    redis_store.publish(INVALIDATE_CHANNEL, json.dumps(keys))
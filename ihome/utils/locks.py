@@ -0,0 +1,59 @@
+# coding=utf-8
+# 基于redis的分布式锁
+
+import time
+import uuid
+
+from ihome import redis_store, constants
+
+
+# 只有锁的持有者才能释放锁,避免锁过期后误删其它进程的锁
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+else
+    return 0
+end
+"""
+
+
+class RedisLock(object):
+    """
+    使用SET NX PX实现的锁,过期时间防止持有者异常退出后锁无法释放
+    with RedisLock(name, expires) as acquired: 获取失败时acquired为False
+    """
+
+    def __init__(self, name, expires, wait=0):
+        """
+        :param name: 锁的名字
+        :param expires: 锁的过期时间,单位：毫秒
+        :param wait: 获取锁时最多等待的时间,单位：秒,0表示不等待
+        """
+        self.key = "lock_%s" % name
+        self.expires = expires
+        self.wait = wait
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+
+    def acquire(self):
+        """获取锁,成功返回True"""
+        deadline = time.time() + self.wait
+        while True:
+            if redis_store.set(self.key, self.token, nx=True, px=self.expires):
+                self.acquired = True
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(constants.LOCK_RETRY_INTERVAL)
+
+    def release(self):
+        """释放自己持有的锁"""
+        if self.acquired:
+            self.acquired = False
+            redis_store.eval(RELEASE_SCRIPT, 1, self.key, self.token)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,43 @@
+# coding=utf-8
+# 超时未接单订单的清理
+# 房东一直没有处理的订单会一直占用房屋的日期,定期分批取消超时的订单,由发件箱事件释放日期
+
+import datetime
+
+from ihome import db, constants
+from ihome.utils import outbox
+
+
+def expire_wait_accept_orders(batch=constants.ORDER_EXPIRE_BATCH):
+    """
+    取消创建超过ORDER_WAIT_ACCEPT_EXPIRES秒仍未接单的订单
+    每批订单在一个事务中加锁并修改状态,避免与房东接单同时进行
+    :return: 取消的订单数
+    """
+    from ihome.models import Order
+
+    deadline = datetime.datetime.now() - datetime.timedelta(seconds=constants.ORDER_WAIT_ACCEPT_EXPIRES)
+    total = 0
+    while True:
+        # 使用订单状态的索引查询超时的订单,并锁定这些订单
+        orders = db.session.query(Order.id, Order.house_id, Order.begin_date, Order.end_date) \
+            .filter(Order.status == "WAIT_ACCEPT", Order.create_time < deadline) \
+            .order_by(Order.id).limit(batch).with_for_update().all()
+        if not orders:
+            break
+        try:
+            db.session.query(Order).filter(Order.id.in_([order.id for order in orders])) \
+                .update({Order.status: "CANCELED", Order.comment: u"房东超时未接单"}, synchronize_session=False)
+            # 在同一个事务中记录事件,由后台worker释放订单占用的日期,并让按日期过滤的房屋列表缓存失效
+            for order in orders:
+                outbox.add_event("order_released", house_id=order.house_id,
+                                 begin_date=order.begin_date.strftime("%Y-%m-%d"),
+                                 end_date=order.end_date.strftime("%Y-%m-%d"))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        total += len(orders)
+        if len(orders) < batch:
+            break
+    return total
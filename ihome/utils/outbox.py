@@ -0,0 +1,168 @@
+# coding=utf-8
+# 事务性发件箱
+# 接口在修改数据的同一个事务中把领域事件写入发件箱表,提交后不再同步处理缓存,
+# 由后台的worker分批读取事件,执行缓存失效、索引更新等操作,处理成功后删除事件,
+# 处理失败的事件保留在表中,下一次继续处理,超过重试次数后不再处理等待人工排查
+
+import datetime
+import json
+
+from flask import current_app
+from ihome import db, constants
+from ihome.utils import availability, cache, comments, house_index
+from ihome.utils.locks import RedisLock
+
+
+# 会影响按日期过滤的房屋列表的事件
+BOOKING_EVENTS = ("order_booked", "order_released")
+
+
+def add_event(event_type, **payload):
+    """在当前事务中记录事件,需要由调用方提交事务"""
+    from ihome.models import OutboxEvent
+
+    event = OutboxEvent()
+    event.event_type = event_type
+    event.payload = json.dumps(payload)
+    db.session.add(event)
+
+
+def _parse_date(date_str):
+    """解析事件中的日期"""
+    return datetime.datetime.strptime(date_str, "%Y-%m-%d")
+
+
+def _order_booked(payload):
+    """订单占用了房屋的日期,记录到已预订日期索引中"""
+    availability.mark_booked(payload["house_id"], _parse_date(payload["begin_date"]),
+                             _parse_date(payload["end_date"]))
+
+
+def _order_released(payload):
+    """订单被拒绝或取消,释放房屋的日期"""
+    availability.release_booked(payload["house_id"], _parse_date(payload["begin_date"]),
+                                _parse_date(payload["end_date"]))
+
+
+def _order_commented(payload):
+    """
+    把新的评价追加到评论列表缓存和房屋详情缓存中,失败时删除这些缓存
+    add_comment按订单编号去重,事件回滚后重复执行不会产生重复的评论
+    """
+    from ihome.models import Order
+
+    order = Order.comments_query(payload["house_id"]).filter(Order.id == payload["order_id"]).first()
+    if order is None:
+        return
+    try:
+        comments.add_comment(order)
+    except Exception as e:
+        current_app.logger.error(e)
+        comments.delete_comments(order.house_id)
+
+
+def _house_changed(payload):
+    """
+    房屋的列表数据发生变化,先按最新的数据更新排序索引,再删除房屋卡片,让城区的房屋列表缓存失效,
+    避免缓存失效后的请求从旧的索引中生成页面
+    """
+    from ihome.models import House
+
+    house = House.query.get(payload["house_id"])
+    if house is None:
+        return
+    house_index.index_house(house)
+    cache.delete_house_cards(house.id)
+    cache.invalidate_houses_list(area_id=house.area_id)
+
+
+def _house_detail_changed(payload):
+    """房屋的详情数据发生变化,删除房屋详情缓存"""
+    cache.delete_values("house_info_%s" % payload["house_id"])
+
+
+def _user_avatar_changed(payload):
+    """房东的头像发生变化,删除该用户发布的房屋的卡片和详情缓存"""
+    from ihome.models import House
+
+    houses_ids = [house_id for house_id, in db.session.query(House.id).filter(House.user_id == payload["user_id"])]
+    cache.delete_house_cards(*houses_ids)
+    cache.delete_values(*["house_info_%s" % house_id for house_id in houses_ids])
+
+
+def _user_name_changed(payload):
+    """用户的昵称发生变化,删除该用户发布的房屋的详情缓存,以及该用户评价过的房屋的评论列表和详情缓存"""
+    from ihome.models import House, Order
+
+    houses_ids = [house_id for house_id, in db.session.query(House.id).filter(House.user_id == payload["user_id"])]
+    cache.delete_values(*["house_info_%s" % house_id for house_id in houses_ids])
+    commented_ids = db.session.query(Order.house_id).filter(
+        Order.user_id == payload["user_id"], Order.status == "COMPLETE", Order.comment != None).distinct()
+    for house_id, in commented_ids:
+        comments.delete_comments(house_id)
+
+
+# 事件类型和处理函数,drain回滚后整批事件会重新执行,处理函数必须可以重复执行
+HANDLERS = {
+    "order_booked": _order_booked,
+    "order_released": _order_released,
+    "order_commented": _order_commented,
+    "house_changed": _house_changed,
+    "house_detail_changed": _house_detail_changed,
+    "user_avatar_changed": _user_avatar_changed,
+    "user_name_changed": _user_name_changed,
+}
+
+
+def rebuild_indexes():
+    """
+    已预订日期索引或排序索引没有就绪时重建索引,包括首次部署和索引维护失败撤销了就绪标记之后
+    重建期间其它worker不处理事件,重建完成后再处理重建期间产生的事件
+    :return: 是否可以处理事件,其它worker正在重建索引时返回False
+    """
+    missing = [index for index in (availability, house_index) if not index.is_ready()]
+    if not missing:
+        return True
+    lock = RedisLock("rebuild_indexes", constants.INDEX_REBUILD_LOCK_EXPIRES)
+    if not lock.acquire():
+        return False
+    try:
+        for index in missing:
+            if not index.is_ready():
+                index.rebuild()
+    finally:
+        lock.release()
+    return True
+
+
+def drain(batch=constants.OUTBOX_BATCH):
+    """
+    处理一批事件,事件在处理期间被锁定,多个worker不会重复处理
+    :return: 处理成功的事件数
+    """
+    from ihome.models import OutboxEvent
+
+    events = OutboxEvent.query.filter(OutboxEvent.attempts < constants.OUTBOX_MAX_ATTEMPTS) \
+        .order_by(OutboxEvent.id).limit(batch).with_for_update().all()
+    processed = 0
+    booking_changed = False
+    for event in events:
+        try:
+            HANDLERS[event.event_type](json.loads(event.payload))
+        except Exception as e:
+            current_app.logger.error(e)
+            event.attempts += 1
+            continue
+        db.session.delete(event)
+        processed += 1
+        if event.event_type in BOOKING_EVENTS:
+            booking_changed = True
+    # 一批事件只让按日期过滤的房屋列表缓存失效一次,失败时回滚,这批事件下一次重新处理
+    if booking_changed:
+        try:
+            cache.invalidate_houses_list(booking=True)
+        except Exception:
+            db.session.rollback()
+            raise
+    db.session.commit()
+    return processed
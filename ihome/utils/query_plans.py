@@ -0,0 +1,161 @@
+# coding=utf-8
+# 热点查询的执行计划检查
+# 对下单、房屋列表、房屋详情、预订日历、订单列表等热点查询执行EXPLAIN,
+# 任何一个查询出现全表扫描(type为ALL)时视为失败;需要在准备了数据的数据库上运行,
+# 表中数据太少时mysql可能认为全表扫描更快,可以先用seed写入测试数据
+
+import datetime
+import random
+
+from ihome import db, constants
+
+
+# 测试用户的名字前缀,用来判断是否已经写入过测试数据
+SEED_USER_PREFIX = "explain_seed_"
+
+
+def _insert(model, rows):
+    """分批插入数据"""
+    batch = constants.QUERY_PLAN_SEED_BATCH
+    for start in range(0, len(rows), batch):
+        db.session.execute(model.__table__.insert(), rows[start:start + batch])
+
+
+def seed(house_count):
+    """
+    向数据库写入测试的用户、房屋和订单,只能用于测试数据库;已经写入过测试数据时不再写入
+    订单只写入订单表,不会更新redis中的已预订日期索引和排序索引
+    :return: 写入的房屋数
+    """
+    from werkzeug.security import generate_password_hash
+    from ihome.models import User, Area, House, Order
+
+    if User.query.filter(User.name == SEED_USER_PREFIX + "0").first() is not None:
+        return 0
+    # 使用固定的随机数种子,每次写入的数据分布相同
+    rand = random.Random(0)
+    now = datetime.datetime.now().replace(microsecond=0)
+    today = now.replace(hour=0, minute=0, second=0)
+    area_ids = [area_id for area_id, in db.session.query(Area.id)]
+    if not area_ids:
+        _insert(Area, [{"name": u"测试城区%s" % i, "create_time": now, "update_time": now} for i in range(10)])
+        area_ids = [area_id for area_id, in db.session.query(Area.id)]
+    # 用户
+    password_hash = generate_password_hash(SEED_USER_PREFIX)
+    user_count = max(house_count // constants.QUERY_PLAN_SEED_HOUSES_PER_USER, 1)
+    _insert(User, [{"name": SEED_USER_PREFIX + str(i), "mobile": "190%08d" % i, "password_hash": password_hash,
+                    "create_time": now, "update_time": now} for i in range(user_count)])
+    user_ids = [user_id for user_id, in db.session.query(User.id).filter(User.name.like(SEED_USER_PREFIX + "%"))]
+    # 房屋
+    houses = []
+    for i in range(house_count):
+        create_time = now - datetime.timedelta(days=rand.randint(0, 720), seconds=rand.randint(0, 86399))
+        houses.append({"user_id": rand.choice(user_ids), "area_id": rand.choice(area_ids),
+                       "title": u"测试房屋%s" % i, "price": rand.randint(100, 100000),
+                       "address": u"测试地址%s" % i, "room_count": rand.randint(1, 5),
+                       "capacity": rand.randint(1, 10), "order_count": rand.randint(0, 100),
+                       "create_time": create_time, "update_time": create_time})
+    _insert(House, houses)
+    houses_ids = [house_id for house_id, in db.session.query(House.id).join(User, House.user_id == User.id)
+                  .filter(User.name.like(SEED_USER_PREFIX + "%"))]
+    # 订单,日期分布在今天前后半年内,各种状态都有
+    orders = []
+    for house_id in houses_ids:
+        for i in range(constants.QUERY_PLAN_SEED_ORDERS_PER_HOUSE):
+            begin_date = today + datetime.timedelta(days=rand.randint(-180, 180))
+            days = rand.randint(1, 7)
+            status = rand.choice(Order.status.type.enums)
+            create_time = begin_date - datetime.timedelta(days=rand.randint(1, 30))
+            orders.append({"user_id": rand.choice(user_ids), "house_id": house_id, "begin_date": begin_date,
+                           "end_date": begin_date + datetime.timedelta(days=days - 1), "days": days,
+                           "house_price": 10000, "amount": 10000 * days, "status": status,
+                           "comment": u"测试评价" if status == "COMPLETE" else None,
+                           "create_time": create_time, "update_time": create_time})
+    _insert(Order, orders)
+    db.session.commit()
+    # 更新表的统计信息,让优化器按照写入后的数据量选择执行计划
+    if db.engine.dialect.name == "mysql":
+        db.session.execute(db.text("ANALYZE TABLE ih_user_profile, ih_house_info, ih_order_info"))
+        db.session.commit()
+    return house_count
+
+
+def _hot_queries(house, user_id):
+    """
+    构造需要检查的热点查询
+    :return: [(查询名, 查询对象)]
+    """
+    from ihome.models import House, Order
+    from ihome.api_1_0.house import build_houses_query, build_house_calendar_query
+    from ihome.api_1_0.orders import build_user_orders_query
+
+    today = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    end_date = today + datetime.timedelta(days=3)
+    # 房屋列表先查询房屋编号,再批量获取房屋卡片
+    house_ids = db.session.query(House.id)
+    return [
+        ("save_order_conflict", db.session.query(Order.id).filter(
+            Order.house_id == house.id, Order.status.in_(constants.ORDER_BLOCKING_STATUS),
+            Order.begin_date <= end_date, Order.end_date >= today).limit(1)),
+        ("houses_list_area_price", build_houses_query(house.area_id, None, None, "price-inc", house_ids)
+            .limit(constants.HOUSE_LIST_PAGE_CAPACITY)),
+        ("houses_list_area_booking", build_houses_query(house.area_id, None, None, "booking", house_ids)
+            .limit(constants.HOUSE_LIST_PAGE_CAPACITY)),
+        ("houses_list_area_new", build_houses_query(house.area_id, None, None, "new", house_ids)
+            .limit(constants.HOUSE_LIST_PAGE_CAPACITY)),
+        # 只传入入住日期,使用NOT EXISTS子查询过滤日期冲突的房屋
+        ("houses_list_dates", build_houses_query(house.area_id, today, None, "new", house_ids)
+            .limit(constants.HOUSE_LIST_PAGE_CAPACITY)),
+        # 同时传入入住和离开日期,已预订日期索引没有就绪或冲突房屋太多时同样使用NOT EXISTS子查询
+        ("houses_list_date_range", build_houses_query(house.area_id, today, end_date, "new", house_ids,
+                                                      use_booked_index=False)
+            .limit(constants.HOUSE_LIST_PAGE_CAPACITY)),
+        ("houses_index", db.session.query(House.id).order_by(House.order_count.desc())
+            .limit(constants.HOME_PAGE_MAX_HOUSES)),
+        ("house_comments", Order.comments_query(house.id).limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS)),
+        ("house_calendar", build_house_calendar_query(house.id, today)),
+        ("user_orders_custom", build_user_orders_query(user_id, "custom")
+            .limit(constants.USER_ORDER_PAGE_CAPACITY)),
+        ("user_orders_landlord", build_user_orders_query(house.user_id, "landlord")
+            .limit(constants.USER_ORDER_PAGE_CAPACITY)),
+        ("expire_orders", db.session.query(Order.id).filter(
+            Order.status == "WAIT_ACCEPT", Order.create_time < today).order_by(Order.id)
+            .limit(constants.ORDER_EXPIRE_BATCH)),
+    ]
+
+
+def explain(query):
+    """
+    对查询执行EXPLAIN
+    :return: 执行计划的每一行组成的字典列表
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN " + str(compiled), params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def check_query_plans():
+    """
+    检查全部热点查询的执行计划
+    :return: [(查询名, 执行计划, 是否全表扫描)],数据库中没有房屋数据时返回None
+    """
+    from ihome.models import House, Order
+
+    house = House.query.first()
+    if house is None:
+        return None
+    order = Order.query.first()
+    user_id = order.user_id if order else house.user_id
+    results = []
+    for name, query in _hot_queries(house, user_id):
+        plan = explain(query)
+        full_scan = any(row.get("type") == "ALL" for row in plan)
+        results.append((name, plan, full_scan))
+    return results
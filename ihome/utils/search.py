@@ -0,0 +1,154 @@
+# coding=utf-8
+# 房屋关键字搜索
+# 每个进程在内存中维护房屋标题和地址的倒排索引,中文按单字和相邻两字切分,
+# 英文和数字按单词切分,按照update_time增量刷新,发布房屋时立即更新
+
+import math
+import re
+import threading
+import time
+
+from ihome import db, constants
+
+
+# 连续的中文或连续的英文数字
+TOKEN_RE = re.compile(u"[\u4e00-\u9fff]+|[a-z0-9]+")
+
+
+def _is_chinese(word):
+    """是否是中文词"""
+    return u"\u4e00" <= word[0] <= u"\u9fff"
+
+
+def tokenize(text, for_query=False):
+    """
+    切分文本
+    中文建立索引时切分出单字和相邻两字,查询时两字以上只使用相邻两字,提高准确度
+    :return: 词的列表
+    """
+    if not text:
+        return []
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    tokens = []
+    for word in TOKEN_RE.findall(text.lower()):
+        if not _is_chinese(word):
+            tokens.append(word)
+            continue
+        bigrams = [word[i:i + 2] for i in range(len(word) - 1)]
+        if for_query and bigrams:
+            tokens.extend(bigrams)
+        else:
+            tokens.extend(word)
+            tokens.extend(bigrams)
+    return tokens
+
+
+class HouseSearchIndex(object):
+    """房屋标题和地址的倒排索引"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 保证同一时间只有一个线程从数据库加载
+        self._refresh_lock = threading.Lock()
+        # 词到{房屋编号: 权重}的映射
+        self._postings = {}
+        # 房屋编号到该房屋的词的映射,房屋更新时用来删除旧的词
+        self._documents = {}
+        self._last_update_time = None
+        self._last_refresh = 0
+
+    def _remove(self, house_id):
+        """从索引中删除房屋"""
+        for token in self._documents.pop(house_id, ()):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(house_id, None)
+                if not postings:
+                    del self._postings[token]
+
+    def _add(self, house_id, title, address):
+        """把房屋加入索引,标题中的词权重更高"""
+        self._remove(house_id)
+        weights = {}
+        for token in tokenize(title):
+            weights[token] = weights.get(token, 0) + constants.HOUSE_SEARCH_TITLE_WEIGHT
+        for token in tokenize(address):
+            weights[token] = weights.get(token, 0) + 1
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[house_id] = weight
+        self._documents[house_id] = tuple(weights)
+
+    def index_house(self, house):
+        """房屋发布或修改后立即更新本进程的索引"""
+        with self._lock:
+            self._add(house.id, house.title, house.address)
+
+    def refresh(self, force=False):
+        """增量加载update_time之后变化的房屋,两次刷新之间至少间隔HOUSE_SEARCH_REFRESH_INTERVAL秒"""
+        now = time.time()
+        if not force and now - self._last_refresh < constants.HOUSE_SEARCH_REFRESH_INTERVAL:
+            return
+        # 同一时间只有一个线程查询数据库,首次加载时其它线程等待加载完成
+        if not self._refresh_lock.acquire(force or not self._last_refresh):
+            return
+        try:
+            if not force and time.time() - self._last_refresh < constants.HOUSE_SEARCH_REFRESH_INTERVAL:
+                return
+            self._load(now)
+        finally:
+            self._refresh_lock.release()
+
+    def _load(self, now):
+        """查询数据库,把变化的房屋加入索引"""
+        from ihome.models import House
+
+        query = db.session.query(House.id, House.title, House.address, House.update_time)
+        if self._last_update_time is not None:
+            query = query.filter(House.update_time >= self._last_update_time)
+        houses = query.all()
+        with self._lock:
+            for house in houses:
+                self._add(house.id, house.title, house.address)
+                if self._last_update_time is None or house.update_time > self._last_update_time:
+                    self._last_update_time = house.update_time
+            self._last_refresh = now
+
+    def search(self, keyword, limit=constants.HOUSE_SEARCH_MAX_RESULTS):
+        """
+        查询同时包含关键字中所有词的房屋
+        :return: 按相关度从高到低排列的房屋编号列表
+        """
+        tokens = set(tokenize(keyword, for_query=True))
+        if not tokens:
+            return []
+        with self._lock:
+            postings_list = [self._postings.get(token) for token in tokens]
+            if not all(postings_list):
+                return []
+            total = float(len(self._documents))
+            # 从最短的倒排列表开始求交集
+            postings_list.sort(key=len)
+            scores = {}
+            for house_id, weight in postings_list[0].items():
+                scores[house_id] = 0.0
+            for postings in postings_list:
+                idf = math.log(total / len(postings)) + 1
+                for house_id in list(scores):
+                    weight = postings.get(house_id)
+                    if weight is None:
+                        del scores[house_id]
+                    else:
+                        scores[house_id] += weight * idf
+        ranked = sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)
+        return [house_id for house_id, score in ranked[:limit]]
+
+
+# 每个进程一份搜索索引
+house_search_index = HouseSearchIndex()
+
+
+def search_houses(keyword):
+    """刷新索引后搜索房屋,返回按相关度排列的房屋编号"""
+    house_search_index.refresh()
+    return house_search_index.search(keyword)
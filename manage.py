@@ -1,6 +1,6 @@
 # coding=utf-8
 # 项目启动文件
-from ihome import create_app, db
+from ihome import create_app, db, constants
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from ihome import models
@@ -12,5 +12,80 @@ manager = Manager(app)
 manager.add_command("db", MigrateCommand)
 
 
+@manager.command
+def rebuild_availability():
+    """根据订单表重建房屋已预订日期索引"""
+    from ihome.utils import availability
+    availability.rebuild()
+
+
+@manager.command
+def rebuild_house_rank():
+    """根据房屋表重建房屋列表排序索引"""
+    from ihome.utils import house_index
+    house_index.rebuild()
+
+
+@manager.command
+def invalidate_reference_data():
+    """修改城区或设施数据后,删除redis缓存并通知所有进程删除进程内缓存"""
+    from ihome import redis_store
+    from ihome.utils import local_cache
+    redis_store.delete("area_info", "area_info_stale")
+    local_cache.publish_invalidation("area_info", "facility_ids")
+
+
+
+@manager.option("-i", "--interval", dest="interval", type=int, default=0, help="循环执行的间隔秒数,0表示只执行一次")
+def expire_orders(interval):
+    """取消超时未接单的订单,释放房屋的日期"""
+    import time
+    from ihome.utils import order_expiry
+    while True:
+        count = order_expiry.expire_wait_accept_orders()
+        app.logger.info("expired %s orders" % count)
+        if not interval:
+            break
+        time.sleep(interval)
+
+
+@manager.option("-s", "--seed", dest="seed", type=int, default=0,
+                help="检查前写入指定数量的测试房屋及其用户和订单,只能用于测试数据库")
+def explain_queries(seed):
+    """检查热点查询的执行计划,出现全表扫描时以非0状态退出"""
+    import sys
+    from ihome.utils import query_plans
+    if seed:
+        print("seeded %s houses" % query_plans.seed(seed))
+    results = query_plans.check_query_plans()
+    if results is None:
+        print("no houses in database, run with --seed to write test data first")
+        sys.exit(1)
+    failed = False
+    for name, plan, full_scan in results:
+        print("%s %s" % ("FULL SCAN" if full_scan else "OK", name))
+        for row in plan:
+            print("    %s" % row)
+        failed = failed or full_scan
+    if failed:
+        sys.exit(1)
+
+
+@manager.option("-i", "--interval", dest="interval", type=float, default=constants.OUTBOX_POLL_INTERVAL,
+                help="没有待处理的事件时等待的秒数")
+def outbox_worker(interval):
+    """持续处理发件箱中的事件,执行缓存失效和索引更新,索引没有就绪时先重建索引"""
+    import time
+    from ihome.utils import outbox
+    while True:
+        try:
+            count = outbox.drain() if outbox.rebuild_indexes() else 0
+        except Exception as e:
+            app.logger.error(e)
+            count = 0
+        # 处理了一整批事件时可能还有积压,立即处理下一批
+        if count < constants.OUTBOX_BATCH:
+            time.sleep(interval)
+
 if __name__ == '__main__':
     manager.run()
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""add composite indexes for order and house queries
+
+Revision ID: 3a9f1c2d7b4e
+Revises: 5b0e7d9a1c23
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9f1c2d7b4e'
+down_revision = '5b0e7d9a1c23'
+branch_labels = None
+depends_on = None
+
+
+# (索引名, 表名, 字段)
+INDEXES = [
+    ('ix_order_house_status_date', 'ih_order_info', ['house_id', 'status', 'begin_date', 'end_date']),
+    ('ix_order_user_ctime', 'ih_order_info', ['user_id', 'create_time', 'id']),
+    ('ix_order_house_ctime', 'ih_order_info', ['house_id', 'create_time', 'id']),
+    ('ix_order_house_status_utime', 'ih_order_info', ['house_id', 'status', 'update_time']),
+    ('ix_order_status_ctime', 'ih_order_info', ['status', 'create_time']),
+    ('ix_house_area_price', 'ih_house_info', ['area_id', 'price']),
+    ('ix_house_area_order_count', 'ih_house_info', ['area_id', 'order_count']),
+    ('ix_house_area_ctime', 'ih_house_info', ['area_id', 'create_time']),
+    ('ix_house_order_count', 'ih_house_info', ['order_count']),
+    ('ix_house_update_time', 'ih_house_info', ['update_time']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
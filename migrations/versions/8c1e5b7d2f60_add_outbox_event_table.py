@@ -0,0 +1,32 @@
+"""add outbox event table
+
+Revision ID: 8c1e5b7d2f60
+Revises: 3a9f1c2d7b4e
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5b7d2f60'
+down_revision = '3a9f1c2d7b4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ih_outbox_event',
+    sa.Column('create_time', sa.DateTime(), nullable=True),
+    sa.Column('update_time', sa.DateTime(), nullable=True),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_type', sa.String(length=32), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('ih_outbox_event')
@@ -0,0 +1,7 @@
+#!/bin/sh
+# 启动后台任务和web服务
+# outbox_worker处理发件箱中的事件(缓存失效/已预订日期索引/排序索引),不运行时缓存不会失效
+# expire_orders定期取消超时未接单的订单
+python /data/manage.py outbox_worker &
+python /data/manage.py expire_orders -i 600 &
+exec python /data/manage.py runserver
@@ -0,0 +1,90 @@
+# coding=utf-8
+# 热点页面的查询次数回归测试
+# 使用sqlite内存数据库,通过before_cursor_execute事件统计执行的sql语句数,
+# 防止模型方法中重新出现逐条查询关联数据的N+1问题
+
+import datetime
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+from ihome import db
+from ihome.models import User, Area, Facility, House, HouseImage, Order
+
+
+class QueryCountTestCase(unittest.TestCase):
+    """查询次数测试"""
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        db.init_app(app)
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            self.statements.append(statement)
+        self.count_statement = count_statement
+        event.listen(db.engine, "before_cursor_execute", self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, "before_cursor_execute", self.count_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_houses(self, count, comment_count=0):
+        """
+        创建房屋,每套房屋属于不同的房东和城区,带有图片、设施和评论
+        :return: 房屋编号列表
+        """
+        facilities = [Facility(name="facility%s" % i) for i in range(3)]
+        db.session.add_all(facilities)
+        houses = []
+        for i in range(count):
+            user = User(name="user%s" % i, mobile="1380000%04d" % i, password_hash="hash", avatar_url="avatar%s" % i)
+            house = House(user=user, area=Area(name="area%s" % i), title="house%s" % i, price=100 * (i + 1),
+                          index_image_url="image%s" % i)
+            house.images = [HouseImage(url="image%s_%s" % (i, j)) for j in range(3)]
+            house.facilities = facilities
+            houses.append(house)
+            for j in range(comment_count):
+                guest = User(name="guest%s_%s" % (i, j), mobile="1390%03d%04d" % (i, j), password_hash="hash")
+                now = datetime.datetime.now()
+                db.session.add(Order(user=guest, house=house, begin_date=now, end_date=now, days=1,
+                                     house_price=house.price, amount=house.price, status="COMPLETE",
+                                     comment="comment%s" % j))
+        db.session.add_all(houses)
+        db.session.commit()
+        houses_ids = [house.id for house in houses]
+        # 清空会话,之后的查询不能使用会话中已经加载的对象
+        db.session.remove()
+        return houses_ids
+
+    def test_house_detail(self):
+        """房屋详情固定执行四次查询:房屋和房东、图片、设施、评论和评论的用户"""
+        house_id = self.create_houses(1, comment_count=5)[0]
+        del self.statements[:]
+        house_dict = House.detail_query().filter(House.id == house_id).first().to_full_dict()
+        self.assertEqual(len(self.statements), 4)
+        self.assertEqual(len(house_dict["img_urls"]), 3)
+        self.assertEqual(len(house_dict["facilities"]), 3)
+        self.assertTrue(house_dict["comments"])
+
+    def test_house_listing(self):
+        """房屋列表每页只执行一次查询,与页面中的房屋数无关"""
+        self.create_houses(6)
+        for count in (1, 3, 6):
+            del self.statements[:]
+            houses = House.listing_query().order_by(House.id).limit(count).all()
+            houses_dict_list = [house.to_basic_dict() for house in houses]
+            self.assertEqual(len(houses_dict_list), count)
+            self.assertEqual(len(self.statements), 1)
+            db.session.remove()
+
+
+if __name__ == "__main__":
+    unittest.main()